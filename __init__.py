@@ -1,3 +1,4 @@
+import sys
 import rc
 import io
 import utils
@@ -7,7 +8,17 @@ import plot
 import check
 import fancyplot
 import analyze
+import batch
+import build
+import perf
+import bench
+import checkpoint
+import catalog
+import provenance
+import filters
+import phxstore
 
-stars = rc.stars
-observed = rc.observed
+# loaded from rc when first used
+sys.modules[__name__] = rc.LazyModule(sys.modules[__name__], {'stars': lambda: rc.stars,
+                                                             'observed': lambda: rc.observed})
 
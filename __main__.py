@@ -0,0 +1,4 @@
+import sys
+import cli
+
+sys.exit(cli.main())
@@ -35,7 +35,8 @@ def phx_compare_table():
 
 def fuv_cont_spec(star):
     """Get just the continuum flux regions of a star's panspec."""
-    spec = io.readpan(star)
+    wrange = [np.min(rc.contbands), np.max(rc.contbands)]
+    spec = io.readpan(star, wrange=wrange)
     return utils.keepranges(spec, rc.contbands, ends='exact')
 
 
@@ -0,0 +1,132 @@
+"""
+Run the reduction for many stars at once, each in its own worker process.
+"""
+import sys
+import time
+import Queue
+import traceback
+import multiprocessing as mp
+
+from astropy.table import Table
+
+import rc
+import db
+import io
+import reduce as red
+
+
+def theworks(stars=None, jobs=None, silent=True, progress=None, **kwargs):
+    """
+    Run reduce.theworks for each star in stars (rc.observed if None) with up
+    to jobs worker processes at once (one per cpu if None).
+
+    Each star is reduced in its own process, so an exception for one star
+    does not stop the others. A worker that dies without reporting back
+    (e.g. a segfault or being killed for using too much memory) is recorded
+    with the status 'crashed'. Each worker saves the normalization
+    factors for its star to rc.normfacs, which is safe to do concurrently.
+
+    The files for every star are worked out up front with db.plan, so the
+    workers don't each search the data folders for them. A star whose files
+    can't be worked out is recorded as failed without stopping the others.
+
+    If progress is True (the default if not silent), a line is printed as
+    each star finishes.
+
+    Extra keywords are passed on to reduce.theworks.
+
+    Returns
+    -------
+    status : astropy table
+        One row per star giving whether the reduction succeeded ('ok',
+        'failed', or 'crashed'), how long it took, and the error message if
+        it failed.
+    """
+    if stars is None:
+        stars = rc.observed
+    if type(stars) is str:
+        stars = [stars]
+    if jobs is None:
+        jobs = mp.cpu_count()
+    if progress is None:
+        progress = not silent
+
+    stages = kwargs.get('stages', None)
+    customs = stages is None or 'custom' in stages
+    coadds = stages is None or 'coadd' in stages
+    start = time.time()
+    errors = {}
+    plans = db.plan(stars, customs=customs, coadds=coadds, errors=errors)
+
+    queue = mp.Queue()
+    waiting = [star for star in stars if star in plans]
+    running = {}
+    results = {}
+
+    def record(result):
+        star = result['star']
+        results[star] = result
+        if star in running:
+            running.pop(star)[0].join()
+        if progress:
+            print '[{}/{}] {} {} ({:.1f} s)'.format(len(results), len(stars), star, result['status'], result['time'])
+            if result['status'] != 'ok':
+                print result['error']
+            sys.stdout.flush()
+
+    for star in stars:
+        if star in errors:
+            record({'star': star, 'status': 'failed', 'time': time.time() - start, 'error': errors[star]})
+
+    try:
+        while len(waiting) or len(running):
+            while len(waiting) and len(running) < jobs:
+                star = waiting.pop(0)
+                task = (star, plans[star], silent, kwargs)
+                proc = mp.Process(target=_work, args=(task, queue))
+                proc.start()
+                running[star] = proc, time.time()
+
+            try:
+                record(queue.get(timeout=0.5))
+            except Queue.Empty:
+                pass
+
+            # a worker that dies hard never sends a result
+            for star, (proc, start) in running.items():
+                if proc.is_alive():
+                    continue
+                proc.join()
+                try: # its result may still be on the way
+                    while star in running:
+                        record(queue.get(timeout=1.0))
+                except Queue.Empty:
+                    error = 'worker process exited with code {}'.format(proc.exitcode)
+                    record({'star': star, 'status': 'crashed', 'time': time.time() - start, 'error': error})
+    finally:
+        for proc, _ in running.values():
+            proc.terminate()
+            proc.join()
+
+    rows = [results[star] for star in stars]
+    names = ['star', 'status', 'time', 'error']
+    data = [[row[name] for row in rows] for name in names]
+    status = Table(data=data, names=names)
+    status['time'].unit = 's'
+    return status
+
+
+def _work(task, queue):
+    """Reduce a single star within a worker process, catching any error and putting the result in queue."""
+    star, plan, silent, kwargs = task
+    start = time.time()
+    try:
+        try:
+            with db.using({star: plan}):
+                red.theworks(star, silent=silent, **kwargs)
+        finally:
+            io.flush() # the process exits without running atexit handlers
+        status, error = 'ok', ''
+    except Exception:
+        status, error = 'failed', traceback.format_exc()
+    queue.put({'star': star, 'status': status, 'time': time.time() - start, 'error': error})
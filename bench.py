@@ -0,0 +1,233 @@
+"""
+Benchmarks of the hot paths of the reduction that run on synthetic data, so
+that performance can be measured without the MUSCLES data tree.
+
+fakespec makes a spectrum in memory and maketree writes a small but complete
+fake data tree for a star (HST x1d files, a Lya model, an interpolated PHOENIX
+spectrum, photometry, filter curves, and settings). run times each hot path at
+several data sizes and reports the throughput.
+"""
+import os
+import time
+import shutil
+import tempfile
+
+import numpy as np
+from astropy.io import fits
+from astropy.table import Table
+
+import rc
+import io
+import utils
+import reduce as red
+
+fakestar = 'fake'
+
+# configuration, wavelength range, and data folder of the fake source spectra
+sources = [['hst_cos_g130m', [1140., 1440.], 'uv'],
+           ['hst_cos_g160m', [1400., 1790.], 'uv'],
+           ['hst_sts_g230l', [1570., 3150.], 'uv'],
+           ['hst_sts_g430l', [2900., 5700.], 'visible']]
+phxrange = [1000., 55000.]
+lyarange = [1205., 1226.]
+
+# fake photometry as filter id: [file name, central wavelength]
+photometry = {'Johnson:B': ['johnsonB', 4400.], 'Johnson:V': ['johnsonV', 5500.],
+              '2MASS:J': ['2massJ', 12350.], '2MASS:H': ['2massH', 16620.],
+              '2MASS:Ks': ['2massKs', 21590.], 'WISE:W1': ['wiseW1', 33500.]}
+
+airglow = [[1214., 1217.5], [1302., 1306.5], [1355., 1357.]]
+emission_lines = [1206.5, 1238.8, 1335.7, 1393.8, 1548.2, 2796.4]
+
+
+def fakeflux(w, Teff=3500.):
+    """
+    Flux of a fake M dwarf at wavelengths w (AA): a blackbody normalized to
+    1e-13 erg/s/cm2/AA at 4000 AA plus a faint chromosphere with emission lines.
+    """
+    hc_kT = 1.4388e8 / Teff
+    bb = 1e-13 * (4000. / w)**5 * np.expm1(hc_kT / 4000.) / np.expm1(np.minimum(hc_kT / w, 700.))
+    lines = sum([50. * np.exp(-0.5 * ((w - wl) / 0.1)**2) for wl in emission_lines])
+    return bb + 1e-16 * (1. + lines)
+
+
+def fakespec(n, wrange=(1140., 1440.), config='hst_cos_g130m', star=fakestar, sn=10., seed=0, model=False,
+             logbins=False, name=''):
+    """
+    Make a fake spectrum with n bins covering wrange with a signal to noise
+    of about sn (lower in faint regions, so there are some negative fluxes).
+    Model spectra have no noise and zero errors.
+    """
+    rand = np.random.RandomState(seed)
+    if logbins:
+        we = np.logspace(np.log10(wrange[0]), np.log10(wrange[1]), n + 1)
+    else:
+        we = np.linspace(wrange[0], wrange[1], n + 1)
+    w0, w1 = we[:-1], we[1:]
+    flux = fakeflux((w0 + w1) / 2.0)
+    if model:
+        err, expt, start, end = 0.0, 0.0, 0.0, 0.0
+    else:
+        err = flux / sn + 2e-16
+        flux = flux + err * rand.randn(n)
+        expt, start, end = 1000.0, 55000.0, 55000.0 + 1000.0/86400.0
+    if name == '':
+        band = 'r' if 'phx' in config else 'u'
+        name = '_'.join([band, config, star, 'bench{}'.format(seed)])
+    return utils.vecs2spectbl(w0, w1, flux, err, expt, instrument=rc.getinsti(config), start=start, end=end,
+                              star=star, name=name)
+
+
+def writex1d(spec, path):
+    """Write a spectrum to a file formatted like a single-order HST x1d file."""
+    n = len(spec)
+    w = (spec['w0'] + spec['w1']) / 2.0
+    cols = [fits.Column(name='wavelength', format='{}D'.format(n), array=[w]),
+            fits.Column(name='flux', format='{}D'.format(n), array=[spec['flux']]),
+            fits.Column(name='error', format='{}D'.format(n), array=[spec['error']]),
+            fits.Column(name='dq', format='{}I'.format(n), array=[spec['flags']])]
+    hdr = fits.Header()
+    hdr['exptime'] = spec['exptime'][0]
+    hdr['expstart'] = spec['minobsdate'][0]
+    hdr['expend'] = spec['maxobsdate'][0]
+    hdr['sdqflags'] = rc.seriousdqs(path, from_x1d_header=False)
+    hdu = fits.BinTableHDU.from_columns(cols, header=hdr)
+    fits.HDUList([fits.PrimaryHDU(), hdu]).writeto(path)
+
+
+def maketree(folder, n, star=fakestar):
+    """
+    Write a fake data tree for star to folder with about n bins in each source
+    spectrum. Returns a dict of the rc attributes to use with rc.using in
+    order to reduce the fake star.
+    """
+    paths = {'root': folder,
+             'local': folder,
+             'datapath': os.path.join(folder, 'data'),
+             'photometrypath': os.path.join(folder, 'data', 'photometry'),
+             'productspath': os.path.join(folder, 'products'),
+             'checkpointpath': os.path.join(folder, 'products', 'checkpoints'),
+             'filterpath': os.path.join(folder, 'filters'),
+             'filtercachepath': os.path.join(folder, 'filter_curves.npz'),
+             'airglow_path': os.path.join(folder, 'airglow_ranges.csv'),
+             'normfac_file': os.path.join(folder, 'normfac_log.json'),
+             'normfacpath': os.path.join(folder, 'normfacs'),
+             'catalogpath': os.path.join(folder, 'file_catalog.sqlite'),
+             'columnarpath': os.path.join(folder, 'columnar')}
+    paths['normfacs'] = rc.NormfacStore(paths['normfacpath'], paths['normfac_file'])
+    dirs = [os.path.join(paths['datapath'], f) for f in rc.datafolders]
+    dirs += [paths['photometrypath'], paths['productspath'], paths['filterpath'], os.path.join(folder, 'settings')]
+    for d in dirs:
+        os.makedirs(d)
+
+    with rc.using(**paths):
+        rc.StarSettings(star).save()
+        np.savetxt(rc.airglow_path, airglow, delimiter=',')
+
+        # observations
+        for i, (config, wrange, datafolder) in enumerate(sources):
+            spec = fakespec(n, wrange, config, star, seed=i)
+            name = '_'.join([datafolder[0], config, star, 'bench{}'.format(i), 'x1d.fits'])
+            writex1d(spec, os.path.join(rc.datapath, datafolder, name))
+
+        # lya model
+        lya = fakespec(max(n // 10, 100), lyarange, 'mod_lya_young', star, model=True)
+        wlya = (lya['w0'] + lya['w1']) / 2.0
+        lya['flux'] = 1e-12 * np.exp(-0.5 * ((wlya - 1215.67) / 0.3)**2)
+        lyapath = os.path.join(rc.datapath, 'uv', 'u_mod_lya_young_{}_bench.fits'.format(star))
+        lya.meta['NAME'] = os.path.basename(lyapath)[:-5]
+        io.writefits(lya, lyapath)
+
+        # phoenix model, in surface flux units like the real thing
+        phx = fakespec(n, phxrange, 'mod_phx_-----', star, model=True, logbins=True)
+        phx['flux'] *= 1e20
+        phx.meta['NAME'] = os.path.basename(rc.phxpath(star))[:-5]
+        io.writefits(phx, rc.phxpath(star))
+
+        # photometry and filter response curves
+        rand = np.random.RandomState(len(sources))
+        rows = []
+        for filt, (fname, wcen) in sorted(photometry.items()):
+            wf = np.linspace(0.8 * wcen, 1.2 * wcen, 200)
+            response = np.exp(-0.5 * ((wf - wcen) / (0.05 * wcen))**2)
+            np.savetxt(os.path.join(rc.filterpath, fname + '.txt'), np.transpose([wf, response]),
+                       header='wavelength response')
+            fnu = fakeflux(wcen) * wcen**2 / 2.998e18 * 1e23 # Jy
+            fnu *= 1 + 0.02 * rand.randn()
+            rows.append([filt, 2.998e18 / wcen / 1e9, fnu, 0.03 * fnu])
+        tbl = Table(rows=rows, names=['sed_filter', 'sed_freq', 'sed_flux', 'sed_eflux'])
+        tbl.write(os.path.join(rc.photometrypath, 'photometry_{}.vot'.format(star)), format='votable')
+
+    return paths
+
+
+def timeit(func, repeat=3):
+    """Best wall time of repeat calls to func."""
+    best = np.inf
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        best = min(best, time.time() - start)
+    return best
+
+
+def _cases(n):
+    """Return (name, function) pairs for each in-memory hot path with a spectrum of n bins."""
+    spec = fakespec(n)
+    neg = fakespec(n, sn=1.)
+    newbins = utils.wbins(fakespec(n // 3, [1150., 1430.]))
+    inner = fakespec(n // 3, [1250., 1350.], 'hst_sts_g140m', seed=1)
+    red_spec = fakespec(n, [1400., 1700.], 'hst_cos_g160m', seed=2)
+    exposures = [fakespec(n, [1140. + 0.1*i, 1440. + 0.1*i], seed=i) for i in range(3)]
+    for i, s in enumerate(exposures):
+        s.meta['FILENAME'] = s.meta['NAME'] + '_x1d.fits'
+    gap = np.ones(n, bool)
+    gap[int(0.49*n):int(0.51*n)] = False
+    gappy = spec[gap]
+
+    return [['rebin', lambda: utils.rebin(spec, newbins)],
+            ['split_exact', lambda: utils.split_exact(spec, 1290.05, 'both')],
+            ['splice', lambda: red.splice(spec, inner)],
+            ['optimal_splice', lambda: red.optimal_splice(spec, red_spec, minsplice=0.005)],
+            ['coadd', lambda: red.coadd(exposures, maskbaddata=False, silent=True)],
+            ['fill_gaps', lambda: red.fill_gaps(gappy, fill_with=rc.gap_fit_order, fit_span=rc.gap_fit_span,
+                                                silent=True)],
+            ['killnegatives', lambda: utils.killnegatives(neg)]]
+
+
+def run(sizes=(1000, 10000, 100000), panspectrum=True, repeat=3, silent=False):
+    """
+    Time each hot path at each of the data sizes (number of bins in the
+    spectra). panspectrum is run on a fake data tree in a temporary folder
+    that is removed afterward.
+
+    Returns
+    -------
+    results : astropy table
+        The best time and throughput (bins/s) of each function at each size.
+    """
+    rows = []
+    def record(name, n, t):
+        rows.append([name, n, t, n / t])
+        if not silent:
+            print '{:<16} {:>8d} bins {:>10.4f} s {:>12.0f} bins/s'.format(name, n, t, n / t)
+
+    for n in sizes:
+        for name, func in _cases(n):
+            record(name, n, timeit(func, repeat))
+
+    if panspectrum:
+        for n in sizes:
+            folder = tempfile.mkdtemp(prefix='muscles_bench_')
+            try:
+                paths = maketree(folder, n)
+                with rc.using(**paths):
+                    t = timeit(lambda: red.panspectrum(fakestar, silent=True), repeat)
+                record('panspectrum', n, t)
+            finally:
+                shutil.rmtree(folder)
+
+    results = Table(rows=rows, names=['function', 'bins', 'time', 'throughput'])
+    results['time'].unit = 's'
+    results['throughput'].unit = '1/s'
+    return results
@@ -0,0 +1,185 @@
+"""
+Keep track of the inputs used to make the products of each stage of
+reduce.theworks so that stages whose inputs haven't changed can be skipped.
+
+The inputs of a stage are summarized by a fingerprint: a hash of the contents
+of the source files, the star's settings, the rc constants the stage uses, and
+the code version. The fingerprint of the last successful run of each stage is
+kept in a small json manifest for each star in rc.buildpath, along with the
+content hashes of the files (so that files whose size and modification time
+haven't changed don't need to be hashed again).
+"""
+import os
+import json
+import hashlib
+
+import rc
+import db
+
+stages = ['phx', 'custom', 'coadd', 'pan', 'hlsp']
+
+# modules whose source is part of the code version
+codemodules = ['rc', 'db', 'io', 'utils', 'reduce', 'filters', 'phxstore']
+
+_codeversion = None
+
+
+def manifestpath(star):
+    """The path of the build manifest for a star."""
+    return os.path.join(rc.buildpath, star + '.json')
+
+
+def loadmanifest(star):
+    try:
+        with open(manifestpath(star)) as f:
+            return json.load(f)
+    except IOError:
+        return {'stages': {}, 'hashes': {}}
+
+
+def savemanifest(star, manifest):
+    if not os.path.exists(rc.buildpath):
+        os.makedirs(rc.buildpath)
+    with rc.atomic_write(manifestpath(star)) as tmp:
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+
+
+def filehash(path, known=None):
+    """
+    Return the md5 hash of the contents of the file at path, reusing the hash
+    in known (a dict of path: [size, mtime, hash]) if the file's size and
+    modification time match. known is updated with the result.
+    """
+    stat = os.stat(path)
+    if known is not None and path in known:
+        size, mtime, digest = known[path]
+        if size == stat.st_size and mtime == stat.st_mtime:
+            return digest
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2**20), ''):
+            md5.update(chunk)
+    digest = md5.hexdigest()
+    if known is not None:
+        known[path] = [stat.st_size, stat.st_mtime, digest]
+    return digest
+
+
+def codeversion():
+    """A hash of rc.version and the source of the reduction code."""
+    global _codeversion
+    if _codeversion is None:
+        md5 = hashlib.md5(rc.version)
+        folder = os.path.dirname(os.path.abspath(__file__))
+        for name in codemodules:
+            with open(os.path.join(folder, name + '.py'), 'rb') as f:
+                md5.update(f.read())
+        _codeversion = md5.hexdigest()
+    return _codeversion
+
+
+def inputs(star, stage):
+    """
+    Return the source files, outputs, and other inputs (settings, constants,
+    etc.) of a stage of reduce.theworks for star.
+    """
+    sets = rc.loadsettings(star).todict()
+    other = {'code': codeversion()}
+
+    if stage == 'phx':
+        files = []
+        outputs = [rc.phxpath(star)]
+        other['starprops'] = [float(rc.starprops[key][star]) for key in ['Teff_muscles', 'logg', 'FeH', 'aM']]
+        other['rc'] = [rc.phxTgrid, rc.phxggrid, rc.phxZgrid, rc.phxagrid]
+    elif stage == 'custom':
+        files, outputs = [], []
+        for custom in sets['custom_extractions']:
+            x2dfiles = db.findfiles('u', star, custom['config'], 'x2d', fullpaths=True)
+            files.extend(x2dfiles)
+            files.extend([f.replace('x2d', 'x1d') for f in x2dfiles]) # used for the trace if they exist
+            outputs.extend([f.replace('x2d', 'custom_spec') for f in x2dfiles])
+        other['settings'] = sets['custom_extractions']
+    elif stage == 'coadd':
+        groups = db.coaddgroups(star)
+        files = sum(groups, [])
+        outputs = [db.coaddpath(g[0]) for g in groups if db.makescoadd(g)]
+        other['settings'] = sets['reject_specs']
+        other['rc'] = [rc.instruments]
+    elif stage == 'pan':
+        files, lyafile = db.panfiles(star)
+        if lyafile is not None:
+            files = files + [lyafile]
+        curves = [os.path.join(rc.filterpath, f) for f in os.listdir(rc.filterpath) if f.endswith('.txt')]
+        files = files + [db.photometrypath(star), rc.airglow_path] + curves
+        outputs = [db.panpath(star), db.dpanpath(star, rc.panres)]
+        other['settings'] = sets
+        other['rc'] = [rc.prenormed, rc.normranges, rc.lyacut, rc.panres, rc.norm2phot_outlier_cut,
+                       rc.gap_fit_order, rc.gap_fit_span, rc.default_order, rc.instruments]
+    elif stage == 'hlsp':
+        files, lyafile = db.panfiles(star)
+        if lyafile is not None:
+            files = files + [lyafile]
+        files = [db.panpath(star), db.dpanpath(star, rc.panres)] + files
+        outputs = [db.hlsppath(star)]
+        other['settings'] = sets
+        other['starprops'] = [float(rc.starprops[key][star]) for key in ['RA', 'dec']]
+        other['rc'] = [rc.version, rc.instruments, rc.HLSPtelescopes, rc.HLSPinstruments, rc.HLSPgratings]
+    else:
+        raise ValueError('Unknown stage {}. Stages are {}.'.format(stage, stages))
+
+    return files, outputs, other
+
+
+def fingerprint(star, stage, known=None):
+    """
+    Compute the fingerprint of the current inputs to a stage of theworks for
+    star. known is a dict of previously computed file hashes (see filehash).
+    Source files that don't exist (e.g. the photometry of a star that has
+    none) are marked as missing, so adding one later changes the fingerprint.
+    Returns the fingerprint and the list of files the stage produces.
+    """
+    files, outputs, other = inputs(star, stage)
+    md5 = hashlib.md5()
+    for f in sorted(set(files)):
+        md5.update(os.path.basename(f))
+        md5.update(filehash(f, known) if os.path.exists(f) else 'missing')
+    md5.update(json.dumps(other, sort_keys=True, default=_jsonable))
+    return md5.hexdigest(), outputs
+
+
+def run(star, stage, func, silent=False):
+    """
+    Call func() to make the products of a stage of theworks for star unless
+    they already exist and their inputs haven't changed since they were made.
+    Returns True if func was called.
+    """
+    manifest = loadmanifest(star)
+    fp, outputs = fingerprint(star, stage, manifest['hashes'])
+    if manifest['stages'].get(stage, None) == fp and all(map(os.path.exists, outputs)):
+        if not silent:
+            print '\n\ninputs to the {} stage for {} are unchanged, skipping'.format(stage, star)
+        return False
+
+    func()
+
+    manifest['stages'][stage] = fp
+    manifest['hashes'] = {f: v for f, v in manifest['hashes'].items() if os.path.exists(f)}
+    savemanifest(star, manifest)
+    return True
+
+
+def forget(star, stage=None):
+    """Remove the record of a stage (or all stages) so that it will be rebuilt."""
+    manifest = loadmanifest(star)
+    if stage is None:
+        manifest['stages'] = {}
+    else:
+        manifest['stages'].pop(stage, None)
+    savemanifest(star, manifest)
+
+
+def _jsonable(obj):
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    raise TypeError('{} is not JSON serializable'.format(obj))
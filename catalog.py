@@ -0,0 +1,165 @@
+"""
+A persistent catalog of the files in the data tree (rc.datapath,
+rc.productspath, rc.photondir, and rc.solarpath) so that finding files doesn't
+mean listing and filtering whole folders over and over.
+
+The catalog is an SQLite database at rc.catalogpath with a row for each file
+giving its folder, name, and the fields parsed from its name according to the
+naming convention (by db.fileinfo), with indexes on the star so that the files
+for a star are found without scanning the others. A folder is only listed
+again when its modification time changes (i.e. when files are added, removed,
+or renamed), or when it was listed so soon after it changed that a later
+change could have left the modification time the same (see mtimeresolution).
+"""
+import os
+import time
+import sqlite3
+
+import rc
+import db
+
+enabled = True
+
+fields = ['band', 'observatory', 'spectrograph', 'grating', 'star', 'id', 'product']
+
+# coarsest resolution of folder modification times on the filesystems in use, in seconds (1 on HFS+, 2 on FAT)
+mtimeresolution = 2.0
+
+# version of the schema of the dirs and files tables, which are rebuilt if it changes
+_version = 1
+
+_schema = """
+CREATE TABLE IF NOT EXISTS dirs (folder TEXT PRIMARY KEY, mtime REAL, listed REAL);
+CREATE TABLE IF NOT EXISTS files (folder TEXT, name TEXT, isdir INTEGER, band TEXT, observatory TEXT,
+                                  spectrograph TEXT, grating TEXT, star TEXT, id TEXT, product TEXT,
+                                  PRIMARY KEY (folder, name));
+CREATE INDEX IF NOT EXISTS files_star ON files (star);
+CREATE INDEX IF NOT EXISTS files_folder_star ON files (folder, star);
+"""
+
+_connections = {}
+
+
+def roots():
+    return [os.path.abspath(p) for p in [rc.datapath, rc.productspath, rc.photondir, rc.solarpath]]
+
+
+def connect():
+    """The connection to the catalog for this process."""
+    key = os.getpid(), rc.catalogpath
+    if key not in _connections:
+        folder = os.path.dirname(rc.catalogpath)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        con = sqlite3.connect(rc.catalogpath, timeout=60.0)
+        con.text_factory = str
+        if con.execute('PRAGMA user_version').fetchone()[0] != _version:
+            with con:
+                con.execute('DROP TABLE IF EXISTS dirs')
+                con.execute('DROP TABLE IF EXISTS files')
+            con.execute('PRAGMA user_version = {}'.format(_version))
+        con.executescript(_schema)
+        _connections[key] = con
+    return _connections[key]
+
+
+def parse(name):
+    """The fields of the naming convention for a file name as a dict (None for any that are missing)."""
+    info = db.fileinfo(os.path.splitext(name)[0])
+    pieces = info.pieces
+    values = {'band': info.band, 'observatory': info.observatory, 'spectrograph': info.spectrograph,
+              'grating': info.grating, 'star': info.star, 'id': info.info(5, 6),
+              'product': pieces[-1] if len(pieces) > 6 else None}
+    return {field: value if value else None for field, value in values.items()}
+
+
+def incatalog(folder):
+    """Whether a folder falls within the data tree covered by the catalog."""
+    folder = os.path.abspath(folder)
+    return any([folder == root or folder.startswith(root + os.sep) for root in roots()])
+
+
+def update(folder, force=False):
+    """List folder again if it may have been modified since it was last listed (or if force is True)."""
+    folder = os.path.abspath(folder)
+    con = connect()
+    mtime = os.path.getmtime(folder)
+    row = con.execute('SELECT mtime, listed FROM dirs WHERE folder=?', (folder,)).fetchone()
+    if row is not None and row[0] == mtime and row[1] - mtime > mtimeresolution and not force:
+        return
+
+    listed = time.time()
+    rows = []
+    for name in os.listdir(folder):
+        info = parse(name)
+        rows.append([folder, name, os.path.isdir(os.path.join(folder, name))] + [info[field] for field in fields])
+    with con:
+        con.execute('DELETE FROM files WHERE folder=?', (folder,))
+        con.executemany('INSERT INTO files VALUES (?,?,?,?,?,?,?,?,?,?)', rows)
+        con.execute('INSERT OR REPLACE INTO dirs VALUES (?,?,?)', (folder, mtime, listed))
+
+
+def refresh(force=False):
+    """
+    Bring the catalog of the whole data tree up to date, listing only the
+    folders that have changed (all of them if force is True).
+    """
+    con = connect()
+    visited = []
+    stack = [root for root in roots() if os.path.isdir(root)]
+    while len(stack):
+        folder = stack.pop()
+        if folder in visited:
+            continue
+        update(folder, force=force)
+        visited.append(folder)
+        subdirs = con.execute('SELECT name FROM files WHERE folder=? AND isdir=1', (folder,))
+        stack.extend([os.path.join(folder, name) for name, in subdirs])
+
+    # forget folders that no longer exist
+    known = [folder for folder, in con.execute('SELECT folder FROM dirs')]
+    with con:
+        for folder in known:
+            if not os.path.isdir(folder):
+                con.execute('DELETE FROM dirs WHERE folder=?', (folder,))
+                con.execute('DELETE FROM files WHERE folder=?', (folder,))
+
+
+def _checkfields(values):
+    unknown = [key for key in values if key not in fields]
+    if len(unknown):
+        raise ValueError('Unknown fields {}. Fields are {}.'.format(unknown, fields))
+
+
+def find(folder, *substrings, **values):
+    """
+    Names of the files in folder that contain all of the substrings and
+    whose parsed name fields equal values (e.g. star='gj832'), in sorted
+    order. Matching on a star uses the index rather than scanning the folder.
+    """
+    _checkfields(values)
+    if not incatalog(folder):
+        names = filter(lambda name: all([s in name for s in substrings]), os.listdir(folder))
+        if len(values):
+            names = filter(lambda name: all([parse(name)[k] == v for k, v in values.items()]), names)
+        return sorted(names)
+    folder = os.path.abspath(folder)
+    update(folder)
+    keys = sorted(values)
+    sql = ('SELECT name FROM files WHERE folder=?' + ''.join([' AND {}=?'.format(key) for key in keys])
+           + ' AND instr(name, ?) > 0'*len(substrings) + ' ORDER BY name')
+    params = [folder] + [values[key] for key in keys] + list(substrings)
+    return [name for name, in connect().execute(sql, params)]
+
+
+def query(**values):
+    """
+    Full paths of the files whose parsed name fields equal values, e.g.
+    query(star='gj832', product='x1d'). Only reflects the folders listed so
+    far, so call refresh first to be sure it is complete.
+    """
+    _checkfields(values)
+    keys = sorted(values)
+    sql = 'SELECT folder, name FROM files WHERE isdir=0' + ''.join([' AND {}=?'.format(key) for key in keys])
+    rows = connect().execute(sql + ' ORDER BY folder, name', [values[key] for key in keys])
+    return [os.path.join(folder, name) for folder, name in rows]
@@ -0,0 +1,73 @@
+"""
+Checkpoints that let reduce.theworks (and reduce.panspectrum) resume partway
+through a star after a crash.
+
+For each star, a small json file in rc.checkpointpath records the stages that
+have finished along with any data needed to pick up after them. The
+intermediate spectra of panspectrum are saved alongside it as FITS files.
+theworks clears a star's checkpoints when it starts (unless resuming) and
+when it finishes.
+"""
+import os
+import json
+import shutil
+
+import rc
+import io
+
+
+def folder(star):
+    return os.path.join(rc.checkpointpath, star)
+
+
+def _statepath(star):
+    return os.path.join(folder(star), 'state.json')
+
+
+def specpath(star, name):
+    return os.path.join(folder(star), '{}_{}.fits'.format(star, name))
+
+
+def load(star):
+    """The checkpoint state for star as a dict of stage: data for the finished stages."""
+    try:
+        with open(_statepath(star)) as f:
+            return json.load(f)
+    except IOError:
+        return {}
+
+
+def done(star, stage):
+    return stage in load(star)
+
+
+def data(star, stage):
+    """The data saved with the checkpoint for a stage (None if there is none)."""
+    return load(star).get(stage, None)
+
+
+def mark(star, stage, **data):
+    """Record that a stage has finished, along with any data needed to resume after it."""
+    io.flush() # be sure any files from the stage are written before saying it is done
+    if not os.path.exists(folder(star)):
+        os.makedirs(folder(star))
+    state = load(star)
+    state[stage] = data
+    with rc.atomic_write(_statepath(star)) as tmp:
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+
+
+def savespec(star, name, spec):
+    if not os.path.exists(folder(star)):
+        os.makedirs(folder(star))
+    io.writefits(spec, specpath(star, name), overwrite=True)
+
+
+def readspec(star, name):
+    return io.readstdfits(specpath(star, name))
+
+
+def clear(star):
+    """Remove all checkpoints for star."""
+    shutil.rmtree(folder(star), ignore_errors=True)
@@ -0,0 +1,66 @@
+"""
+Command line interface for running the reduction of many stars, e.g.
+
+    python -m muscles observed --stages coadd,pan,hlsp --jobs 8
+
+from the folder containing the muscles package. Run with --help for options.
+"""
+import argparse
+
+import rc
+import io
+import batch
+import reduce as red
+
+
+def parse_stars(names):
+    """Expand the names 'observed', 'hosts', and 'all' to those lists of stars in rc, dropping repeats."""
+    stars = []
+    for name in names:
+        if name in ['observed', 'hosts']:
+            expanded = getattr(rc, name)
+        elif name == 'all':
+            expanded = rc.stars
+        else:
+            expanded = [name]
+        stars.extend([star for star in expanded if star not in stars])
+    return stars
+
+
+def parse_stages(string):
+    stages = string.split(',')
+    unknown = [stage for stage in stages if stage not in red.allstages]
+    if len(unknown):
+        msg = 'unknown stages {}, choose from {}'.format(','.join(unknown), ','.join(red.allstages))
+        raise argparse.ArgumentTypeError(msg)
+    return stages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='muscles', description='Make the MUSCLES data products for a list of stars.')
+    parser.add_argument('stars', nargs='+',
+                        help="names of stars or 'observed', 'hosts', or 'all' for those lists of stars from rc")
+    parser.add_argument('-s', '--stages', type=parse_stages, default=None,
+                        help='comma-separated list of the stages to run, from {} (default: custom,coadd,pan,hlsp)'
+                             ''.format(','.join(red.allstages)))
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of stars to reduce at once (default: 1)')
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='skip stages whose inputs are unchanged since they were last run')
+    parser.add_argument('-r', '--resume', action='store_true',
+                        help='skip stages that finished in a previous run that did not complete')
+    parser.add_argument('-a', '--async-writes', action='store_true',
+                        help='write files in the background while the reduction continues')
+    parser.add_argument('-v', '--verbose', action='store_true', help='print the full output of the reduction')
+    args = parser.parse_args(argv)
+
+    stars = parse_stars(args.stars)
+    io.asyncwrites = args.async_writes
+    status = batch.theworks(stars, jobs=args.jobs, silent=not args.verbose, progress=True, stages=args.stages,
+                            incremental=args.incremental, resume=args.resume)
+
+    failed = [row['star'] for row in status if row['status'] != 'ok']
+    print '{} of {} stars reduced successfully.'.format(len(stars) - len(failed), len(stars))
+    if len(failed):
+        print 'Failed: ' + ', '.join(failed)
+        return 1
+    return 0
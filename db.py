@@ -1,5 +1,8 @@
-import rc, io
+import rc, io, catalog
 import os
+import time
+import traceback
+from contextlib import contextmanager
 import numpy as np
 from astropy.io import fits
 
@@ -12,11 +15,7 @@ def findfiles(path_or_band, *substrings, **kwargs):
         band = path_or_band if len(path_or_band) > 1 else rc.bandmap[path_or_band]
         path_or_band = rc.datapath + '/' + band
 
-    def good(name):
-        hasstring = [(s in name) for s in substrings]
-        return all(hasstring)
-
-    files = filter(good, os.listdir(path_or_band))
+    files = _names(path_or_band, *substrings)
     if 'fullpaths' in kwargs and kwargs['fullpaths'] == False:
         return files
 
@@ -24,6 +23,40 @@ def findfiles(path_or_band, *substrings, **kwargs):
     return files
 
 
+_listings = {}
+
+def _names(folder, *substrings, **values):
+    """
+    Names of the files in folder that contain all of the substrings and whose
+    parsed name fields equal values (see catalog.find), from the catalog if it
+    is enabled. Results are remembered until the folder is modified or refresh
+    is called (or while the folder was modified too recently to be sure, see
+    catalog.mtimeresolution).
+    """
+    key = os.path.abspath(folder), substrings, tuple(sorted(values.items()))
+    mtime = os.path.getmtime(folder)
+    if key in _listings:
+        oldmtime, listed, names = _listings[key]
+        if oldmtime == mtime and listed - mtime > catalog.mtimeresolution:
+            return list(names)
+    listed = time.time()
+    if catalog.enabled:
+        names = catalog.find(folder, *substrings, **values)
+    else:
+        names = filter(lambda name: all([s in name for s in substrings]), sorted(os.listdir(folder)))
+        if len(values):
+            names = filter(lambda name: all([catalog.parse(name)[k] == v for k, v in values.items()]), names)
+    _listings[key] = mtime, listed, names
+    return list(names)
+
+
+def refresh():
+    """Forget all remembered folder listings and bring the catalog up to date (if enabled)."""
+    _listings.clear()
+    if catalog.enabled:
+        catalog.refresh()
+
+
 def validpath(name):
     if os.path.exists(name):
         return name
@@ -104,13 +137,10 @@ isspec = lambda name: any([s in name for s in rc.specstrings])
 def allspecfiles(star):
     """Find all the spectra for the star within the subdirectories of path
     using the file naming convention."""
-    hasstar = lambda name: star in name
-
     folders = [os.path.join(rc.datapath, p) for p in rc.datafolders]
     files = []
     for sf in folders:
-        allfiles = os.listdir(sf)
-        starfiles = filter(hasstar, allfiles)
+        starfiles = _names(sf, star=star)
         specfiles = filter(isspec, starfiles)
         specfiles = [os.path.join(rc.datapath, sf, f) for f in specfiles]
         files.extend(specfiles)
@@ -128,17 +158,20 @@ def panfiles(star):
     """Return the files for the spectra to be spliced into a panspectrum,
     replacing "raw" files with coadds and custom extractions as appropriate
     and ordering according to how the spectra should be normalized."""
+    if star in _plans:
+        return list(_plans[star].panfiles), _plans[star].lyafile
+    return _panfiles(allsourcefiles(star))
 
-    allfiles = allsourcefiles(star)
-    use = lambda name: any([s in name for s in rc.instruments])
-    allfiles = filter(use, allfiles)
-    filterfiles = lambda s: filter(lambda ss: s == parse_info(ss, 1, 4), allfiles)
-    files = map(filterfiles, rc.instruments)
-    files = reduce(lambda x, y: x + y, files)
+
+def _panfiles(allfiles, customfiles=None, coadds=None):
+    byinst = {}
+    for f in allfiles:
+        byinst.setdefault(fileinfo(f).instrument, []).append(f)
+    files = sum([byinst.get(inst, []) for inst in rc.instruments], [])
 
     # sub in custom extractions
-    files = sub_customfiles(files)
-    files = sub_coaddfiles(files)
+    files = sub_customfiles(files, customfiles)
+    files = sub_coaddfiles(files, coadds)
 
     # parse out lya file
     lyafile = filter(lambda f: 'mod_lya' in f, files)
@@ -153,8 +186,7 @@ def panfiles(star):
 
 
 def solarfiles(date):
-    files = os.listdir(rc.solarpath)
-    files = filter(lambda s: date in s, files)
+    files = _names(rc.solarpath, date)
     ufile = filter(lambda s: 'u' == s[0], files)[0]
     vfile = filter(lambda s: 'v' == s[0], files)[0]
     ufile, vfile = [os.path.join(rc.solarpath, f) for f in (ufile, vfile)]
@@ -174,49 +206,85 @@ def lyafile(star):
         return os.path.basename(files[0])
 
 
+class FileName(object):
+    """
+    A file name split into the pieces of the naming convention, e.g.
+    u_hst_cos_g130m_gj832_lb3401ghq_x1d.fits, with the standard pieces as
+    attributes. Use fileinfo() to get these so each name is only parsed once.
+    """
+    __slots__ = ['pieces', 'band', 'observatory', 'instrument', 'spectrograph', 'grating', 'star', 'id', 'paninfo',
+                 'name']
+
+    def __init__(self, basename):
+        pieces = tuple(basename.split('_'))
+        self.pieces = pieces
+        self.band = '_'.join(pieces[0:1])
+        self.observatory = '_'.join(pieces[1:2])
+        self.instrument = '_'.join(pieces[1:4])
+        self.spectrograph = '_'.join(pieces[2:3])
+        self.grating = '_'.join(pieces[3:4])
+        self.star = '_'.join(pieces[4:5])
+        self.id = '_'.join(pieces[0:6])
+        self.paninfo = '_'.join(pieces[6:])
+        self.name = '.'.join(basename.split('.')[:-1])
+
+    def info(self, start, stop):
+        return '_'.join(self.pieces[start:stop])
+
+
+_filenames = {}
+
+def fileinfo(path):
+    """The FileName record for a file name or path, parsed only the first time it is seen."""
+    try:
+        return _filenames[path]
+    except KeyError:
+        if len(_filenames) > 100000:
+            _filenames.clear()
+        record = FileName(os.path.basename(path))
+        _filenames[path] = record
+        return record
+
+
 def parse_info(filename, start, stop):
     """Parse out the standard information bits from a muscles filename."""
-    name = os.path.basename(filename)
-    pieces = name.split('_')
-    slc = slice(start, stop)
-    return '_'.join(pieces[slc])
+    return fileinfo(filename).info(start, stop)
 
 
 def parse_instrument(filename):
-    return parse_info(filename, 1, 4)
+    return fileinfo(filename).instrument
 
 
 def parse_spectrograph(filename):
-    return parse_info(filename, 2, 3)
+    return fileinfo(filename).spectrograph
 
 
 def parse_grating(filename):
-    return parse_info(filename, 3, 4)
+    return fileinfo(filename).grating
 
 
 def parse_band(filename):
-    return parse_info(filename, 0, 1)
+    return fileinfo(filename).band
 
 
 def parse_star(filename):
-    return parse_info(filename, 4, 5)
+    return fileinfo(filename).star
 
 
 def parse_id(filename):
-    return parse_info(filename, 0, 6)
+    return fileinfo(filename).id
 
 
 def parse_observatory(filename):
-    return parse_info(filename, 1, 2)
+    return fileinfo(filename).observatory
 
 
 def parse_paninfo(filename):
-    return parse_info(filename, 6, None)
+    return fileinfo(filename).paninfo
 
 
 def parse_name(filename):
-    name = os.path.basename(filename)
-    return '.'.join(name.split('.')[:-1])
+    return fileinfo(filename).name
 
 
 def name2path(name):
@@ -225,9 +293,8 @@ def name2path(name):
 
 def allpans(star):
     """All panspec files for a star."""
-    allfiles = os.listdir(rc.productspath)
     identifier = '{}_panspec'.format(star)
-    panfiles = filter(lambda s: identifier in s, allfiles)
+    panfiles = _names(rc.productspath, identifier)
     return [os.path.join(rc.productspath, pf) for pf in panfiles]
 
 
@@ -291,6 +358,11 @@ def coaddpath(specpath):
     return os.path.join(specdir, coaddname)
 
 
+def makescoadd(group):
+    """Whether reduce.auto_coadd writes a coadd file for a group of spectra (several spectra, or echelles)."""
+    return len(group) > 1 or any(['_sts_e' in f for f in group])
+
+
 def photometrypath(star):
     return os.path.join(rc.photometrypath, 'photometry_{}.vot'.format(star))
 
@@ -415,11 +487,47 @@ def auto_rename(folder):
         for name in unchanged: print '    ' + name
 
 
-def find_coaddfile(specfiles):
+def fingerprint(name):
+    """The size and modification time of the file for a spectrum name or path, or -1s if it can't be found."""
+    try:
+        stat = os.stat(validpath(name))
+    except (IOError, OSError, KeyError):
+        return -1, -1.0
+    return stat.st_size, stat.st_mtime
+
+
+def read_manifest(specfile):
+    """
+    Read the source spectra of a file made by io.writefits without reading
+    the spectrum itself. Returns a dict of source name: (size, mtime), where
+    the size and modification time are those of the source file when
+    specfile was made (-1 if they weren't recorded).
+    """
+    with fits.open(specfile) as hdus:
+        try:
+            data = hdus['sourcespecs'].data
+        except KeyError:
+            return {}
+        names = data['sourcespecs']
+        if 'size' in data.names:
+            return {n: (int(sz), float(mt)) for n, sz, mt in zip(names, data['size'], data['mtime'])}
+        return {n: (-1, -1.0) for n in names}
+
+
+def changed_sources(specfile):
+    """Names of the source spectra of specfile whose files have changed (or gone missing) since it was made."""
+    manifest = read_manifest(specfile)
+    return [name for name, recorded in manifest.items() if recorded[0] < 0 or fingerprint(name) != recorded]
+
+
+def find_coaddfile(specfiles, coadds=None):
     """
     Look for a file that is the coaddition of the provided spectlbs.
     Returns the filename if it exists and it contains data from all of the
     provided spectbls, otherwise returns none.
+
+    If coadds is provided, it is used in place of the files on disk as a
+    dict of coadd file: names of the spectra it contains.
     """
     # check for multiple configurations
     insts = np.array(map(parse_instrument, specfiles))
@@ -427,12 +535,14 @@ def find_coaddfile(specfiles):
         return NotImplemented("...can't deal with different data sources.")
 
     coaddfile = coaddpath(specfiles[0])
-    if os.path.isfile(coaddfile):
-        coadd, = io.read(coaddfile)
-
+    if coadds is not None:
+        exists = coaddfile in coadds
+    else:
+        exists = os.path.isfile(coaddfile)
+    if exists:
         # check that the coadd contains the same data as the spectbls
         # return none if any is missing
-        csourcespecs = coadd.meta['SOURCESPECS']
+        csourcespecs = coadds[coaddfile] if coadds is not None else read_manifest(coaddfile)
         for sf in specfiles:
             if parse_name(sf) not in csourcespecs:
                 return None
@@ -443,16 +553,16 @@ def find_coaddfile(specfiles):
         return None
 
 
-def sub_coaddfiles(specfiles):
+def sub_coaddfiles(specfiles, coadds=None):
     """Replace any group of specfiles from the same instrument with a coadd
     file that includes data from all spectra in that group if one exists in the
-    same directory.
+    same directory. See find_coaddfile for coadds.
     """
     groups = group_by_instrument(specfiles)
     result = []
     for group in groups:
         group = filter(lambda s: 'coadd' not in s, group)
-        coaddfile = find_coaddfile(group)
+        coaddfile = find_coaddfile(group, coadds)
         if coaddfile is not None:
             result.append(coaddfile)
         else:
@@ -460,17 +570,23 @@ def sub_coaddfiles(specfiles):
     return result
 
 
-def sub_customfiles(specfiles):
+def sub_customfiles(specfiles, customfiles=None):
     """Replace any file with a custom extraction file for the same instrument
-    if one exists in the same directory."""
+    if one exists in the same directory. If customfiles is provided, the
+    custom extraction files are chosen from it instead of the directory."""
     result = []
     for name in specfiles:
-        customfiles = findsimilar(name, 'custom')
-        if len(customfiles) > 1:
+        if customfiles is None:
+            matches = findsimilar(name, 'custom')
+        else:
+            base = parse_info(name, 0, 6)
+            folder = os.path.dirname(name)
+            matches = [f for f in customfiles if os.path.dirname(f) == folder and base in os.path.basename(f)]
+        if len(matches) > 1:
             raise ValueError('Multiple matching files.')
-        elif len(customfiles) == 1:
-            if customfiles[0] not in result:
-                result.append(customfiles[0])
+        elif len(matches) == 1:
+            if matches[0] not in result:
+                result.append(matches[0])
         else:
             result.append(name)
     return result
@@ -479,12 +595,127 @@ def sub_customfiles(specfiles):
 def coaddgroups(star, nosingles=False):
     """Return a list of groups of files that should be coadded (only HST files).
     Chooses the best source files and avoids dulicates."""
-    allfiles = allsourcefiles(star)
-    allfiles = sub_customfiles(allfiles)
-    hstfiles = filter(lambda s: 'hst' in s, allfiles)
-    filterfiles = lambda s: filter(lambda ss: s in ss, hstfiles)
-    files = map(filterfiles, rc.instruments)
-    files = filter(len, files)
+    if star in _plans:
+        files = [list(group) for group in _plans[star].coaddgroups]
+    else:
+        files = _coaddgroups(allsourcefiles(star))
     if nosingles:
         files = filter(lambda x: len(x) > 1, files)
     return files
+
+
+def _coaddgroups(allfiles, customfiles=None):
+    allfiles = sub_customfiles(allfiles, customfiles)
+    hstfiles = filter(lambda s: 'hst' in s, allfiles)
+    filterfiles = lambda s: filter(lambda ss: s in ss, hstfiles)
+    files = map(filterfiles, rc.instruments)
+    return filter(len, files)
+
+
+# -----------------------------------------------------------------------------
+# PLANNING
+
+class StarPlan(object):
+    """
+    The files for reducing a star as worked out by plan: the source spectra,
+    the custom extraction files, the groups of files to coadd, the coadd
+    files with the names of the spectra each contains, and the files to
+    splice into the panspectrum along with the Lya file.
+    """
+    def __init__(self, star, sourcefiles, customfiles, coaddgroups, coadds, panfiles, lyafile):
+        self.star = star
+        self.sourcefiles = sourcefiles
+        self.customfiles = customfiles
+        self.coaddgroups = coaddgroups
+        self.coadds = coadds
+        self.panfiles = panfiles
+        self.lyafile = lyafile
+
+
+_plans = {}
+
+
+def plan(stars=None, customs=True, coadds=True, errors=None):
+    """
+    Work out the files for reducing each of stars (rc.observed if None) with
+    one listing of the data folders, rather than listing and filtering them
+    again for every star. Returns a dict of star: StarPlan.
+
+    If customs (coadds) is True, the plan includes the files that the custom
+    extraction (coadd) stage of reduce.theworks will make, as if it is run
+    first.
+
+    If errors is a dict, a star whose files can't be worked out (e.g. its
+    settings or a coadd can't be read) is left out of the result and the
+    traceback is put in errors[star], rather than the error being raised.
+
+    Use with using so that panfiles and coaddgroups give the planned files.
+    """
+    if stars is None:
+        stars = rc.observed
+    if type(stars) is str:
+        stars = [stars]
+
+    folders = [os.path.join(rc.datapath, f) for f in rc.datafolders]
+    listings = [[os.path.join(folder, name) for name in _names(folder)] for folder in folders]
+    allcustoms = [f for files in listings for f in files if 'custom' in os.path.basename(f)]
+
+    plans = {}
+    for star in stars:
+        try:
+            starfiles = [filter(lambda f: star in os.path.basename(f), files) for files in listings]
+            specfiles = filter(isspec, sum(starfiles, []))
+            sourcefiles = choosesourcespecs(specfiles)
+
+            customfiles = list(allcustoms)
+            if customs:
+                planned = _plannedcustoms(star, starfiles[rc.datafolders.index(rc.bandmap['u'])])
+                customfiles.extend([f for f in planned if f not in customfiles])
+
+            groups = _coaddgroups(sourcefiles, customfiles)
+            coaddfiles = {}
+            for f in filter(lambda f: 'coadd' in os.path.basename(f), specfiles):
+                coaddfiles[f] = read_manifest(f)
+            if coadds:
+                for group in groups:
+                    if makescoadd(group):
+                        coaddfiles[coaddpath(group[0])] = map(parse_name, group)
+
+            files, lyafile = _panfiles(sourcefiles, customfiles, coaddfiles)
+            plans[star] = StarPlan(star, sourcefiles, customfiles, groups, coaddfiles, files, lyafile)
+        except Exception:
+            if errors is None:
+                raise
+            errors[star] = traceback.format_exc()
+    return plans
+
+
+def _plannedcustoms(star, ufiles):
+    """The custom extraction files reduce.auto_customspec will make for star from the files in the uv folder."""
+    try:
+        sets = rc.loadsettings(star)
+    except IOError:
+        return []
+    result = []
+    for custom in sets.custom_extractions:
+        config = custom['config']
+        if 'hst' in config:
+            x2dfiles = filter(lambda f: config in f and 'x2d' in f, ufiles)
+            result.extend([f.replace('x2d', 'custom_spec') for f in x2dfiles])
+    return result
+
+
+@contextmanager
+def using(plans):
+    """
+    Temporarily have panfiles and coaddgroups return the files in plans (a
+    dict of star: StarPlan from plan) for the stars they cover, rather than
+    finding the files again.
+    """
+    old = dict(_plans)
+    _plans.update(plans)
+    try:
+        yield
+    finally:
+        _plans.clear()
+        _plans.update(old)
@@ -15,8 +15,6 @@ linestyles = itertools.cycle(['-', '--', ':', '.-'])
 linefluxlabel = '$\lambda$-Integrated Flux \n[erg cm$^{-2}$ s$^{-1}$]'
 fluxlabel = 'Flux [erg cm$^{-2}$ s$^{-1}$ $\AA^{-1}$]'
 
-starprops = rc.starprops
-
 def plotnorm(spec_or_star, ax=plt.gca(), clip=1e-10):
     if type(spec_or_star) is str:
         spec = io.read(db.Rpanpath(spec_or_star, 10000))[0]
@@ -149,7 +147,7 @@ def splitSpec(spec, ax=None, wsplit=3000., scale_fac=50.):
 def stars3DMovieFrames(size, azRate=1.0, altRate=0.0, frames=360, dirpath='muscles_stars_movie_frames'):
     from mayavi import mlab
 
-    ra, dec, dist, r, T, names = [starprops.values[s] for s in ['RA', 'dec', 'dist', 'R', 'Teff', 'name txt']]
+    ra, dec, dist, r, T, names = [rc.starprops.values[s] for s in ['RA', 'dec', 'dist', 'R', 'Teff', 'name txt']]
 
     labels = names.values
 
@@ -263,7 +261,7 @@ def lightcurveCompendium(stars='hosts', figure=None, flarecut=2.0, flarelabel='S
         ax.text(-0.5*spacedata, offset + 1.1, ymaxstr, va='top', ha='right', color=color, fontsize=fntsz*0.8)
 
         # label star
-        starlbl = starprops['name tex'][star]
+        starlbl = rc.starprops['name tex'][star]
         ax.text(-3.0*spacedata, offset + 0.5, starlbl, va='center', ha='right', color=color)
 
         # increase offset
@@ -348,7 +346,7 @@ def flareCompare(inst='cos_g130m', band='SiIV', nflares=3, ax=None):
     lines, labels = [], []
     for flare in flares:
         star = flare['star']
-        label = starprops['name tex'][star]
+        label = rc.starprops['name tex'][star]
 
         # curve = reduce.auto_curve(star, inst, bands=bands, dt=dt, appx=False, groups=groups)
         # t0, t1, cps, cpserr = zip(*curve)[0]
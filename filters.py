@@ -0,0 +1,125 @@
+"""
+A registry of the filter response curves in rc.filterpath, so that each curve
+is read from disk once and the quantities needed for synthetic photometry are
+computed once.
+
+The curves are text files with a header line (the zeropoint magnitude for the
+files used by utils.mag) followed by columns of wavelength (AA) and response.
+All of them are kept in a single binary cache (rc.filtercachepath) that is
+rebuilt whenever a file in rc.filterpath is added, removed, or modified.
+"""
+import os
+
+import numpy as np
+from astropy import constants as const, units as u
+
+import rc
+
+c = const.c.to(u.AA/u.s).value
+
+_registry = {}
+
+
+class Filter(object):
+    """
+    A filter response curve with the quantities used for synthetic
+    photometry: the frequencies (Hz) of the curve points, the integrals of the
+    response over wavelength and frequency, and the mean wavelength.
+    """
+    def __init__(self, name, w, response, zeropoint=np.nan):
+        self.name = name
+        self.w = w
+        self.response = response
+        self.zeropoint = zeropoint
+        self.v = c / w
+        self.wnorm = np.trapz(response, w)
+        self.vnorm = np.trapz(response, self.v)
+        self.wmean = np.sum(w*response) / np.sum(response)
+
+    @property
+    def curve(self):
+        """The curve as an Nx2 array of wavelength and response."""
+        return np.transpose([self.w, self.response])
+
+
+def asfilter(band, name=''):
+    """band as a Filter, if it isn't one already (e.g. an Nx2 array of wavelength and response)."""
+    if isinstance(band, Filter):
+        return band
+    w, response = np.asarray(band, float).T
+    return Filter(name, w, response)
+
+
+def _listing():
+    names = sorted(filter(lambda f: f.endswith('.txt'), os.listdir(rc.filterpath)))
+    mtimes = [os.path.getmtime(os.path.join(rc.filterpath, f)) for f in names]
+    return names, mtimes
+
+
+def _parse(path):
+    """Return the zeropoint (nan if the header line isn't one), wavelengths, and response in a filter curve file."""
+    with open(path) as f:
+        header = f.readline().strip()
+        try:
+            zeropoint = float(header)
+        except ValueError:
+            zeropoint = np.nan
+        w, response = np.loadtxt(f, ndmin=2).T
+    return zeropoint, w, response
+
+
+def _build(names, mtimes):
+    """Parse all of the curves and save them in the cache as concatenated arrays."""
+    parsed = [_parse(os.path.join(rc.filterpath, f)) for f in names]
+    zeropoints = [p[0] for p in parsed]
+    lengths = [len(p[1]) for p in parsed]
+    starts = np.concatenate([[0], np.cumsum(lengths)]).astype(int)
+    w = np.concatenate([p[1] for p in parsed]) if len(parsed) else np.zeros(0)
+    response = np.concatenate([p[2] for p in parsed]) if len(parsed) else np.zeros(0)
+    with rc.atomic_write(rc.filtercachepath, suffix='.npz') as tmp:
+        np.savez(tmp, names=names, mtimes=mtimes, zeropoints=zeropoints, starts=starts, w=w, response=response)
+
+
+def _load(names, mtimes):
+    """The contents of the cache, or None if it is missing or out of date."""
+    try:
+        with np.load(rc.filtercachepath) as cache:
+            if list(cache['names']) != names or not np.array_equal(cache['mtimes'], mtimes):
+                return None
+            return {key: cache[key] for key in cache.files}
+    except IOError:
+        return None
+
+
+def refresh():
+    """Load the curves from the cache, rebuilding it first if the files have changed."""
+    names, mtimes = _listing()
+    cache = _load(names, mtimes)
+    if cache is None:
+        _build(names, mtimes)
+        cache = _load(names, mtimes)
+
+    starts, w, response = cache['starts'], cache['w'], cache['response']
+    filters = {}
+    for i, f in enumerate(cache['names']):
+        name = str(f)[:-4]
+        i0, i1 = starts[i], starts[i+1]
+        filters[name] = Filter(name, w[i0:i1], response[i0:i1], float(cache['zeropoints'][i]))
+    _registry.clear()
+    _registry[rc.filterpath] = filters
+    return filters
+
+
+def registry():
+    """All of the filters in rc.filterpath as a dict of name: Filter, where name is the file name without '.txt'."""
+    if rc.filterpath not in _registry:
+        refresh()
+    return _registry[rc.filterpath]
+
+
+def get(name):
+    """The Filter from the file name.txt in rc.filterpath."""
+    try:
+        return registry()[name]
+    except KeyError:
+        raise KeyError('No filter curve {}.txt in {}.'.format(name, rc.filterpath))
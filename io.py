@@ -10,12 +10,19 @@ from astropy.io import fits
 import numpy as np
 from mypy.my_numpy import mids2edges, block_edges, midpts
 from scipy.io import readsav as spreadsav
-import rc, utils, db
+import rc, utils, db, filters, phxstore
 import astropy.table as table
 from astropy.time import Time
 import astropy.units as u
 from warnings import warn
+from collections import OrderedDict
 import os
+import json
+import shutil
+import sys
+import threading
+import Queue
+import atexit
 
 legendcomment = ('This extension is a legend for the integer identifiers in the instrument column of the '
                   'spectrum extension. Instruments are identified by bitwise flags so that any combination of '
@@ -59,9 +66,12 @@ def readpans(star):
     return sum(map(read, panfiles), [])
 
 
-def readpan(star):
+def readpan(star, wrange=None):
+    """Read the native resolution panspectrum of a star, only the bins overlapping wrange if given."""
     if star == 'sun':
         return read_solar()
+    if wrange is not None:
+        return readstdfits(db.panpath(star), wrange=wrange)
     return read(db.panpath(star))[0]
 
 
@@ -107,6 +117,9 @@ def read(specfiles):
 
     The star keyword is used to reject any spectra that are known to be bad
     for that star.
+
+    Spectra are cached (see cachebytes), and copies of the cached tables are
+    returned, so they can be modified freely.
     """
     #if a list of files is provided, reach each and stack the spectra in a list
     if hasattr(specfiles, '__iter__'):
@@ -119,7 +132,7 @@ def read(specfiles):
     star = db.parse_star(specfiles)
     i = specfiles[::-1].find('.')
     fmt = specfiles[-i:]
-    specs = readfunc[fmt](specfiles)
+    specs = _cachedread(specfiles, readfunc[fmt])
     try:
         sets = rc.loadsettings(star)
         if 'coadd' not in specfiles and 'custom' not in specfiles:
@@ -132,19 +145,71 @@ def read(specfiles):
     return specs
 
 
-def readstdfits(specfile):
-    """Read a fits file that was created by writefits."""
-    spectbl = table.Table.read(specfile, hdu=1)
+# maximum size of the spectra kept in memory by read, in bytes (0 to disable caching)
+cachebytes = 500e6
+
+_cache = OrderedDict()
+
+
+def _cachedread(specfile, readfunc):
+    """
+    Read specfile with readfunc, keeping the result in a least recently used
+    cache keyed on the path, modification time, and size of the file. Returns
+    copies of the cached spectra.
+    """
+    if cachebytes <= 0:
+        return readfunc(specfile)
+    stat = os.stat(specfile)
+    key = os.path.abspath(specfile), stat.st_mtime, stat.st_size
+    if key in _cache:
+        specs, nbytes = _cache.pop(key)
+    else:
+        specs = readfunc(specfile)
+        nbytes = sum([sum([spec[name].nbytes for name in spec.colnames]) for spec in specs])
+        if nbytes > cachebytes: # too big to cache, and caching it would evict everything else
+            return specs
+    _cache[key] = specs, nbytes
+    while sum([n for _, n in _cache.values()]) > cachebytes:
+        _cache.popitem(last=False)
+    return [table.Table(spec, copy=True) for spec in specs]
+
+
+def clearcache():
+    """Empty the cache of spectra kept by read."""
+    _cache.clear()
+
+
+def readstdfits(specfile, wrange=None, columns=None):
+    """
+    Read a fits file that was created by writefits.
+
+    The file is memory mapped, so if wrange is given as [wmin, wmax] only the
+    rows for the bins that overlap that range are read from disk (the rows of
+    a FITS table are stored contiguously). HST spectra are the exception:
+    their off-detector ends are trimmed first, which needs all of the rows.
+    columns is an optional list of the columns to keep.
+    """
+    trim = 'hst' in specfile and 'hlsp' not in specfile
+    with fits.open(specfile, memmap=True) as hdus:
+        hdu = hdus[1]
+        i0, i1 = (0, hdu.header['naxis2']) if wrange is None or trim else _rowrange(hdu, wrange)
+        # copy the rows out of the memory map so the file can be safely overwritten later
+        hdu = fits.BinTableHDU(data=hdu.data[i0:i1].copy(), header=hdu.header)
+        spectbl = table.Table.read(hdu)
+        try:
+            sourcespecs = list(hdus['sourcespecs'].data['sourcespecs'])
+        except KeyError:
+            sourcespecs = []
     spectbl.meta['FILENAME'] = specfile
     spectbl.meta['NAME'] = db.parse_name(specfile)
-    try:
-        sourcespecs = fits.getdata(specfile, 'sourcespecs')['sourcespecs']
-        spectbl.meta['SOURCESPECS'] = sourcespecs
-    except KeyError:
-        spectbl.meta['SOURCESPECS'] = []
+    spectbl.meta['SOURCESPECS'] = sourcespecs
 
-    if 'hst' in specfile and 'hlsp' not in specfile:
+    if trim:
         spectbl = __trimHSTtbl(spectbl)
+        if wrange is not None:
+            i0 = np.searchsorted(spectbl['w1'], wrange[0], side='right')
+            i1 = np.searchsorted(spectbl['w0'], wrange[1], side='left')
+            spectbl = spectbl[i0:max(i0, i1)]
 
     if 'hlsp' in specfile:
         for col in spectbl.colnames:
@@ -164,18 +229,137 @@ def readstdfits(specfile):
 
         spectbl['w'] = (spectbl['w0'] + spectbl['w1'])/2
 
+    if columns is not None:
+        spectbl.keep_columns(columns)
+
     return spectbl
 
 
-def readfits(specfile, observatory=None, spectrograph=None):
-    """Read a fits file into standardized table."""
+def _rowrange(hdu, wrange):
+    """
+    The range of rows of a (memory mapped) spectrum table with bins that
+    overlap wrange, found by bisection so that only a few pages of the
+    wavelength columns are read.
+    """
+    names = [name.lower() for name in hdu.columns.names]
+    w0name, w1name = ('wavelength0', 'wavelength1') if 'wavelength0' in names else ('w0', 'w1')
+    w0 = hdu.data.field(names.index(w0name))
+    w1 = hdu.data.field(names.index(w1name))
+    i0 = np.searchsorted(w1, wrange[0], side='right')
+    i1 = np.searchsorted(w0, wrange[1], side='left')
+    return i0, max(i0, i1)
+
+
+# whether readfits keeps a columnar copy of the files written by writefits (see readcolumnar)
+columnar = True
+
+# version of the columnar format, part of the folder names so that copies in an older format are never read
+columnarversion = 1
+
+
+def _columnarfolder(specfile):
+    """The folder of the columnar copy of a version (size and modification time) of a FITS spectrum."""
+    stat = os.stat(specfile)
+    name = '{}.v{}.{}.{!r}'.format(path.basename(specfile), columnarversion, stat.st_size, stat.st_mtime)
+    return path.join(rc.columnarpath, name)
+
+
+def _jsonable(obj):
+    return obj.tolist() if hasattr(obj, 'tolist') else str(obj)
+
+
+def _strpairs(pairs):
+    """Make json objects OrderedDicts of str rather than unicode, like the meta read from FITS."""
+    def tostr(x):
+        if type(x) is unicode:
+            return str(x)
+        if type(x) is list:
+            return map(tostr, x)
+        return x
+    return OrderedDict([(tostr(key), tostr(value)) for key, value in pairs])
+
+
+def writecolumnar(spectbl, specfile):
+    """
+    Save spectbl, as read from specfile, in the columnar format: a folder in
+    rc.columnarpath holding each column as a .npy file and the column
+    attributes and table meta as json. Copies made from older versions of
+    specfile (or in an older format) are removed.
+    """
+    folder = _columnarfolder(specfile)
+    if path.exists(folder):
+        return
+    try:
+        with rc.atomic_write(folder) as tmp:
+            os.makedirs(tmp)
+            cols = []
+            for name in spectbl.colnames:
+                col = spectbl[name]
+                np.save(path.join(tmp, name + '.npy'), np.ascontiguousarray(col.data))
+                unit = None if col.unit is None else col.unit.to_string()
+                cols.append({'name': name, 'unit': unit, 'description': col.description, 'format': col.format})
+            with open(path.join(tmp, 'meta.json'), 'w') as f:
+                json.dump({'columns': cols, 'meta': spectbl.meta}, f, default=_jsonable)
+
+            prefix = path.basename(specfile) + '.'
+            for old in os.listdir(rc.columnarpath):
+                if old.startswith(prefix):
+                    shutil.rmtree(path.join(rc.columnarpath, old), ignore_errors=True)
+    except OSError:
+        if not path.exists(folder): # otherwise another process saved it first
+            raise
+
+
+def readcolumnar(specfile, wrange=None, columns=None):
+    """
+    Read a file created by writefits from its columnar copy, making the copy
+    with readstdfits if the file is new or has changed. The columns are memory
+    mapped, so only the rows in wrange of the columns that are kept are read
+    from disk. They are read into ordinary arrays, so the table doesn't hold
+    the files open (read caches tables, and each map holds a file descriptor).
+    wrange and columns are as for
+    readstdfits. If the copy can't be made (e.g. the disk is full or
+    rc.columnarpath isn't writable), the file is read with readstdfits.
+    """
+    folder = _columnarfolder(specfile)
+    if not path.exists(folder):
+        try:
+            writecolumnar(readstdfits(specfile), specfile)
+        except (IOError, OSError) as e:
+            warn('Could not save a columnar copy of {}: {}'.format(specfile, e))
+            return readstdfits(specfile, wrange=wrange, columns=columns)
+    with open(path.join(folder, 'meta.json')) as f:
+        info = json.load(f, object_pairs_hook=_strpairs)
+
+    arrays = {}
+    for col in info['columns']:
+        arrays[col['name']] = np.load(path.join(folder, col['name'] + '.npy'), mmap_mode='r')
+    i0, i1 = 0, len(arrays['w0'])
+    if wrange is not None:
+        i0 = np.searchsorted(arrays['w1'], wrange[0], side='right')
+        i1 = max(i0, np.searchsorted(arrays['w0'], wrange[1], side='left'))
+
+    cols = []
+    for col in info['columns']:
+        if columns is None or col['name'] in columns:
+            cols.append(table.Column(np.array(arrays[col['name']][i0:i1]), col['name'], unit=col['unit'],
+                                     description=col['description'], format=col['format']))
+    return table.Table(cols, meta=info['meta'], copy=False)
+
+
+def readfits(specfile, observatory=None, spectrograph=None, wrange=None, columns=None):
+    """Read a fits file into standardized table. wrange and columns are passed to readstdfits for files that were
+    created by writefits."""
 
     if observatory is None: observatory = db.parse_observatory(specfile)
 
-    spec = fits.open(specfile)
     if any([s in specfile for s in ['coadd', 'custom', 'mod', 'panspec', 'other', 'hlsp']]):
-        return [readstdfits(specfile)]
-    elif observatory == 'hst':
+        if columnar and 'hlsp' not in specfile:
+            return [readcolumnar(specfile, wrange=wrange, columns=columns)]
+        return [readstdfits(specfile, wrange=wrange, columns=columns)]
+
+    spec = fits.open(specfile, memmap=True)
+    if observatory == 'hst':
         if spectrograph is None: spectrograph = db.parse_spectrograph(specfile)
         if spectrograph in ['sts', 'cos']:
             sd, sh = spec[1].data, spec[1].header
@@ -357,6 +541,53 @@ def readsav(specfile):
     return [__maketbl(data, specfile)]
 
 
+_photometry = {}
+
+
+def _readphotometry(star):
+    """The photometry table for star, parsed only when the file is new or has changed."""
+    f = db.photometrypath(star)
+    mtime = os.path.getmtime(f)
+    if star not in _photometry or _photometry[star][0] != mtime:
+        _photometry[star] = mtime, table.Table.read(f)
+    return _photometry[star][1].copy()
+
+
+def _uniquephotometry(tbl):
+    """
+    Boolean array of the rows of a photometry table to keep after removing
+    duplicate measurements. Of the rows with the same frequency and flux,
+    those with an error are kept (only the last for each value of the error)
+    and those without are dropped, unless none have an error, in which case
+    only the first is kept.
+    """
+    n = len(tbl)
+    freq, flux, eflux = [np.asarray(tbl[name], float) for name in ['sed_freq', 'sed_flux', 'sed_eflux']]
+    index = np.arange(n)
+
+    # group rows with the same frequency and flux
+    order = np.lexsort((index, flux, freq))
+    newgroup = np.ones(n, bool)
+    newgroup[1:] = (freq[order][1:] != freq[order][:-1]) | (flux[order][1:] != flux[order][:-1])
+    group = np.empty(n, int)
+    group[order] = np.cumsum(newgroup) - 1
+    first = np.zeros(n, bool)
+    first[order[newgroup]] = True
+
+    finite = np.isfinite(eflux)
+    hasfinite = np.zeros(n, bool)
+    hasfinite[group[finite]] = True
+
+    # last row of each group with each error value
+    order = np.lexsort((index, eflux, group))
+    lastin = np.ones(n, bool)
+    lastin[:-1] = (group[order][1:] != group[order][:-1]) | (eflux[order][1:] != eflux[order][:-1])
+    last = np.zeros(n, bool)
+    last[order[lastin]] = True
+
+    return np.where(finite, last, first & ~hasfinite[group])
+
+
 def get_photometry(star, lo=0.0, hi=np.inf, silent=False):
     band_dict = {'HIP:VT':'tychoV', 'HIP:BT':'tychoB', "HIP:Hp":'hipparcos',
                  'Johnson:B':'johnsonB', 'Johnson:V':'johnsonV', 'Johnson:K':'johnsonK', 'Johnson:J':'johnsonJ',
@@ -381,7 +612,7 @@ def get_photometry(star, lo=0.0, hi=np.inf, silent=False):
                  'ALHAMBRA:A581M': 'alhambraA581M', 'ALHAMBRA:A948M': 'alhambraA948M',
                  'UCAC:R': 'ucacR', 'DENIS:J':'denisJ', 'DENIS:I':'denisI', 'DENIS:Ks':'denisKs'}
 
-    tbl = table.Table.read(db.photometrypath(star))
+    tbl = _readphotometry(star)
 
     # select known bands
     tbl_bands = set(tbl['sed_filter'])
@@ -391,49 +622,24 @@ def get_photometry(star, lo=0.0, hi=np.inf, silent=False):
         unusable_bands = tbl_bands - known_bands
         print "Unidentified bands: {}".format(unusable_bands)
 
-    # load all known bands in table
+    # get the filter curves of all known bands in table
     bands = {}
     for id in usable_bands:
-        bandstr = band_dict[id]
-        data = np.loadtxt(path.join(rc.filterpath, bandstr + '.txt'), skiprows=1)
-        bands[id] = data
+        bands[id] = filters.get(band_dict[id])
 
     # trim out of range photometry
-    checkrange = lambda band: (band[0,0] > lo) and (band[-1,0] < hi)
+    checkrange = lambda band: (band.w[0] > lo) and (band.w[-1] < hi)
     for id, band in bands.items():
         if not checkrange(band):
             del bands[id]
-    inrange = np.array([s in bands.keys() for s in tbl['sed_filter']], bool)
+    inrange = np.array([s in bands for s in tbl['sed_filter']], bool)
     if np.sum(inrange) == 0:
         print 'No photometry covers range of {} to {} AA.'.format(lo, hi)
         return None
     tbl = tbl[inrange]
 
     # trim to unique photometry
-    i = 0
-    while i < len(tbl):
-        msmt1 = tbl['sed_freq', 'sed_flux'][i]
-        e1 = tbl['sed_eflux'][i]
-        j = i+1
-        delline = False
-        while j < len(tbl):
-            msmt2 =tbl['sed_freq', 'sed_flux'][j]
-            e2 = tbl['sed_eflux'][j]
-            if msmt1.as_void() == msmt2.as_void():
-                if np.isfinite(e2):
-                    if not np.isfinite(e1) or e1 == e2:
-                        delline = True
-                        break
-                    else:
-                        j += 1
-                else:
-                    tbl.remove_row(j)
-            else:
-                j += 1
-        if delline == True:
-            tbl.remove_row(i)
-        else:
-            i += 1
+    tbl = tbl[_uniquephotometry(tbl)]
 
     return tbl, bands
 
@@ -456,61 +662,148 @@ def writefits(spectbl, name, overwrite=False):
     -------
     None
     """
-    spectbl = table.Table(spectbl, copy=True)
-
     # astropy write function doesn't store list meta correctly, so extract here
     # to add later
-    sourcespecs = spectbl.meta['SOURCESPECS']
-    del spectbl.meta['SOURCESPECS'] #otherwise this makes a giant nasty header
-    comments = spectbl.meta['COMMENT']
-    del spectbl.meta['COMMENT']
+    meta = OrderedDict(spectbl.meta)
+    sourcespecs = meta.pop('SOURCESPECS') #otherwise this makes a giant nasty header
+    comments = meta.pop('COMMENT')
+    meta['FILENAME'] = name
+
+    # the columns are shared rather than copied, since they are only read
+    spectbl = table.Table(spectbl, copy=False, meta=meta)
+    spechdu = fits.table_to_hdu(spectbl)
+    spechdu.name = 'spectrum'
+
+    #add column descriptions
+    for i,colname in enumerate(spectbl.colnames):
+        key = 'TDESC' + str(i+1)
+        spechdu.header[key] = spectbl[colname].description
+
+    # add comments
+    if len(comments) == 0: comments = ['']
+    for comment in comments: spechdu.header['COMMENT'] = comment
+
+    #add an extra bintable for the instrument identifiers
+    cols = [fits.Column('instruments','13A', array=rc.instruments),
+            fits.Column('bitvalues', 'I', array=rc.instvals)]
+    hdr = fits.Header()
+    hdr['comment'] = legendcomment
+    idhdu = fits.BinTableHDU.from_columns(cols, header=hdr, name='legend')
+    hdus = [fits.PrimaryHDU(), spechdu, idhdu]
+
+    #add another bintable for the sourcespecs, if needed
+    if len(sourcespecs):
+        maxlen = max([len(ss) for ss in sourcespecs])
+        dtype = '{:d}A'.format(maxlen)
+        sizes, mtimes = zip(*map(db.fingerprint, sourcespecs))
+        col = [fits.Column('sourcespecs', dtype, array=sourcespecs),
+               fits.Column('size', 'K', array=sizes),
+               fits.Column('mtime', 'D', array=mtimes)]
+        hdr = fits.Header()
+        hdr['comment'] = ('This extension contains a list of the source '
+                          'files that were incorporated into this '
+                          'spectrum, with their size and modification '
+                          'time when it was made (-1 if not found).')
+        sfhdu = fits.BinTableHDU.from_columns(col, header=hdr, name='sourcespecs')
+        hdus.append(sfhdu)
+
+    # the hdus hold their own copy of the data, so they can be written in the background
+    if path.exists(name) and not overwrite:
+        raise IOError('File {} already exists. Use overwrite=True to replace it.'.format(name))
+    _write(fits.HDUList(hdus), name, overwrite)
 
-    spectbl.meta['FILENAME'] = name
 
-    #use the native astropy function to write to fits
-    spectbl.write(name, overwrite=overwrite, format='fits')
+# whether writefits and writehlsp hand files to a background thread to write (see AsyncWriter). Call flush to wait
+# for them to be written (it is also called when the interpreter exits).
+asyncwrites = False
 
-    #but open it up to do some modification
-    with fits.open(name, mode='update') as ftbl:
+_writer = None
 
-        #add name to first table
-        ftbl[1].name = 'spectrum'
 
-        #add column descriptions
-        for i,name in enumerate(spectbl.colnames):
-            key = 'TDESC' + str(i+1)
-            ftbl[1].header[key] = spectbl[name].description
+class AsyncWriter(object):
+    """
+    Runs jobs (writing files) one at a time in a background thread. At most
+    maxqueue jobs wait in the queue, so submit blocks when it is full to keep
+    the memory used by the data waiting to be written bounded. An error raised
+    by a job is raised again by the next call to submit or flush.
+    """
+    def __init__(self, maxqueue=4):
+        self.pid = os.getpid()
+        self.queue = Queue.Queue(maxqueue)
+        self.errors = []
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            func, args, kwargs = self.queue.get()
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                self.errors.append(sys.exc_info())
+            finally:
+                self.queue.task_done()
 
-        # add comments
-        if len(comments) == 0: comments = ['']
-        for comment in comments: ftbl[1].header['COMMENT'] = comment
+    def _raise(self):
+        if len(self.errors):
+            exc_type, exc, tb = self.errors[0]
+            del self.errors[:]
+            raise exc_type, exc, tb
 
-        #add an extra bintable for the instrument identifiers
-        cols = [fits.Column('instruments','13A', array=rc.instruments),
-                fits.Column('bitvalues', 'I', array=rc.instvals)]
-        hdr = fits.Header()
-        hdr['comment'] = legendcomment
-        idhdu = fits.BinTableHDU.from_columns(cols, header=hdr, name='legend')
-        ftbl.append(idhdu)
-
-        #add another bintable for the sourcespecs, if needed
-        if len(sourcespecs):
-            maxlen = max([len(ss) for ss in sourcespecs])
-            dtype = '{:d}A'.format(maxlen)
-            col = [fits.Column('sourcespecs', dtype, array=sourcespecs)]
-            hdr = fits.Header()
-            hdr['comment'] = ('This extension contains a list of the source '
-                              'files that were incorporated into this '
-                              'spectrum.')
-            sfhdu = fits.BinTableHDU.from_columns(col, header=hdr, name='sourcespecs')
-            ftbl.append(sfhdu)
-
-        ftbl.flush()
+    def submit(self, func, *args, **kwargs):
+        """Queue func(*args, **kwargs) to be run in the background."""
+        self._raise()
+        self.queue.put((func, args, kwargs))
+
+    def flush(self):
+        """Wait for all of the queued jobs to finish, raising the error from the first that failed, if any."""
+        self.queue.join()
+        self._raise()
+
+
+def writer():
+    """The AsyncWriter for this process."""
+    global _writer
+    if _writer is None or _writer.pid != os.getpid():
+        _writer = AsyncWriter()
+    return _writer
+
+
+def flush():
+    """Wait for any files being written in the background to be written."""
+    if _writer is not None and _writer.pid == os.getpid():
+        _writer.flush()
+
+atexit.register(flush)
+
+
+def _write(hdus, name, overwrite):
+    """Write an HDUList, in the background if asyncwrites is True."""
+    if asyncwrites:
+        writer().submit(_writeto, hdus, name, overwrite)
+    else:
+        _writeto(hdus, name, overwrite)
+
+
+def _writeto(hdus, name, overwrite):
+    """
+    Write an HDUList to a temporary file, then move it into place so that the
+    file is never seen half written.
+    """
+    if path.exists(name) and not overwrite:
+        raise IOError('File {} already exists. Use overwrite=True to replace it.'.format(name))
+    with rc.atomic_write(name) as tmp:
+        hdus.writeto(tmp)
 
 def phxdata(Teff, logg=4.5, FeH=0.0, aM=0.0, repo='ftp', ftpbackup=True):
     """
     Get a phoenix spectral data from the repo and return as an array.
 
+    The spectrum comes from the local store of the grid (see phxstore) if it
+    is there. Recently used spectra are kept in memory, so the array is read
+    only.
+
     If ftpbackup is True, the ftp repository will be quieried if the file
     isn't found in the specified repo location and the file will be saved
     in the specified location.
@@ -520,17 +813,23 @@ def phxdata(Teff, logg=4.5, FeH=0.0, aM=0.0, repo='ftp', ftpbackup=True):
     assert FeH in rc.phxZgrid
     assert aM in rc.phxagrid
 
+    spec = phxstore.get(Teff, logg, FeH, aM)
+    if spec is not None:
+        return spec
+
     path = rc.phxurl(Teff, logg, FeH, aM, repo=repo)
     try:
-        fspec = fits.open(path)
+        spec = fits.getdata(path)
     except IOError:
         if ftpbackup and repo != 'ftp':
             warn('PHX file not found in specified repo, pulling from ftp.')
             rc.fetchphxfile(Teff, logg, FeH, aM, repo=repo)
-            fspec = fits.open(path)
+            spec = fits.getdata(path)
         else:
             raise IOError('File not found at {}.'.format(path))
-    return fspec[0].data
+    spec = np.array(spec)
+    phxstore.remember(spec, Teff, logg, FeH, aM)
+    return spec
 
 def __maketbl(data, specfile, sourcespecs=[]):
     star = specfile.split('_')[4]
@@ -881,7 +1180,7 @@ def writehlsp(star_or_spectbl, components=True, overwrite=False):
         hdus.append(srchdu)
 
     hdus = fits.HDUList(hdus)
-    hdus.writeto(hlspname, clobber=overwrite)
+    _write(hdus, hlspname, overwrite)
 
 
 def read_xsections(species, dissoc_only=True):
@@ -0,0 +1,168 @@
+"""
+Optional instrumentation of the stages of the reduction. Off by default.
+
+Wrap a block of code in `with perf.stage(name):` to record its wall time, cpu
+time, bytes read and written, and the peak memory of the process while it ran.
+On Linux the peak is measured per stage by resetting the kernel's high-water
+mark (VmHWM) when each stage starts. Elsewhere it can't be reset, so the
+increase in the process's peak over the stage is recorded instead (zero if the
+stage stayed below an earlier peak). When instrumentation is disabled, stage
+returns a shared do-nothing context manager, so the cost is a single function
+call.
+
+Use enable() to turn it on. reduce.theworks then writes a json and a csv
+report of the stages for each star to rc.perfpath.
+"""
+import os
+import sys
+import time
+import json
+import csv
+import resource
+
+import rc
+
+enabled = False
+records = []
+_stack = []
+
+fields = ['stage', 'depth', 'wall', 'cpu', 'read', 'written', 'peakmem', 'failed']
+units = {'wall': 's', 'cpu': 's', 'read': 'bytes', 'written': 'bytes', 'peakmem': 'bytes'}
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    """Discard all records."""
+    del records[:]
+    del _stack[:]
+
+
+class _NullStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_nullstage = _NullStage()
+
+
+class _Stage(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        # resetting the high-water mark would lose the peaks of the enclosing stages so far, so save them first
+        hwm = _hwm()
+        for parent in _stack:
+            parent.peak = max(parent.peak, hwm)
+        self.peak = 0
+        self.reset = _resetpeak()
+        self.maxrss0 = _maxrss()
+        _stack.append(self)
+        self.read0, self.written0 = _iobytes()
+        self.cpu0 = _cputime()
+        self.wall0 = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        wall = time.time() - self.wall0
+        cpu = _cputime() - self.cpu0
+        read, written = _iobytes()
+        if self.reset:
+            peak = max(self.peak, _hwm())
+        else:
+            peak = _maxrss() - self.maxrss0
+        for parent in _stack[:-1]:
+            parent.peak = max(parent.peak, peak)
+        record = {'stage': '/'.join([s.name for s in _stack]), 'depth': len(_stack) - 1, 'wall': wall,
+                  'cpu': cpu, 'read': read - self.read0, 'written': written - self.written0, 'peakmem': peak,
+                  'failed': exc_type is not None}
+        records.append(record)
+        _stack.pop()
+        return False
+
+
+def stage(name):
+    """Context manager that records the resources used by the enclosed code as the stage name."""
+    if not enabled:
+        return _nullstage
+    return _Stage(name)
+
+
+def report(star, folder=None):
+    """
+    Write the records to json and csv files for star in folder (rc.perfpath
+    by default) and then discard them. Returns the paths of the files.
+    """
+    if folder is None:
+        folder = rc.perfpath
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    jsonpath = os.path.join(folder, '{}_perf.json'.format(star))
+    with open(jsonpath, 'w') as f:
+        json.dump({'star': star, 'units': units, 'stages': records}, f, indent=1)
+
+    csvpath = os.path.join(folder, '{}_perf.csv'.format(star))
+    with open(csvpath, 'wb') as f:
+        writer = csv.DictWriter(f, fields)
+        writer.writeheader()
+        writer.writerows(records)
+
+    reset()
+    return jsonpath, csvpath
+
+
+def _cputime():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _iobytes():
+    """Bytes read and written by the process so far."""
+    try:
+        with open('/proc/self/io') as f:
+            counts = dict(line.split(': ') for line in f)
+        return int(counts['rchar']), int(counts['wchar'])
+    except IOError:
+        # no procfs (e.g. mac), so fall back on block counts
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_inblock * 512, usage.ru_oublock * 512
+
+
+def _maxrss():
+    """Peak resident memory of the process over its whole life in bytes."""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def _resetpeak():
+    """Reset the high-water mark of resident memory (Linux only). Returns True if it could be reset."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except IOError:
+        return False
+
+
+def _hwm():
+    """Peak resident memory since the last _resetpeak in bytes (0 if there is no procfs)."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    return 0
@@ -0,0 +1,114 @@
+"""
+A local store of the PHOENIX grid, so that interpolating a spectrum (see
+reduce.phxspec) doesn't mean opening a separate HiRes FITS file for every
+corner of the grid cell.
+
+build packs the spectra downloaded to rc.phxrepo into a single array file in
+rc.phxstorepath with a row for each spectrum. The first four values of each
+row are the (Teff, logg, FeH, aM) of the spectrum, so the index is written in
+the same (atomic) step as the spectra. The array is memory mapped, so only the
+rows that are used are read, and the most recently used spectra are also kept
+in memory. io.phxdata looks for spectra here first.
+"""
+import os
+from collections import OrderedDict
+from itertools import product
+
+import numpy as np
+from astropy.io import fits
+
+import rc
+
+# number of spectra to keep in memory
+cachesize = 32
+
+_store = {}
+_cache = OrderedDict()
+
+
+def _key(Teff, logg, FeH, aM):
+    return tuple([round(float(x), 2) for x in [Teff, logg, FeH, aM]])
+
+
+def _path():
+    return os.path.join(rc.phxstorepath, 'grid.npy')
+
+
+def build(repo=None, silent=False):
+    """
+    Pack all of the PHOENIX spectra in repo (rc.phxrepo if None) into the
+    store, replacing what was there.
+    """
+    if repo is None:
+        repo = rc.phxrepo
+    names = set(os.listdir(repo))
+    grid = []
+    for combo in product(*rc.phxgrids):
+        name = os.path.basename(rc.phxurl(*combo, repo=repo))
+        if name in names:
+            grid.append([combo, os.path.join(repo, name)])
+    if len(grid) == 0:
+        raise IOError('No PHOENIX spectra found in {}.'.format(repo))
+    if not silent:
+        print 'packing {} PHOENIX spectra from {} into {}'.format(len(grid), repo, rc.phxstorepath)
+
+    first = fits.getdata(grid[0][1])
+    if not os.path.exists(rc.phxstorepath):
+        os.makedirs(rc.phxstorepath)
+    with rc.atomic_write(_path()) as tmp:
+        store = np.lib.format.open_memmap(tmp, mode='w+', dtype=first.dtype.newbyteorder('='),
+                                          shape=(len(grid), 4 + len(first)))
+        for i, (combo, path) in enumerate(grid):
+            store[i, :4] = combo
+            with fits.open(path) as hdus:
+                store[i, 4:] = hdus[0].data
+        store.flush()
+        del store
+    _store.clear()
+    _cache.clear()
+
+
+def load():
+    """
+    The store as (spectra, index), where spectra is the memory mapped array
+    and index is a dict of (Teff, logg, FeH, aM): row. None if there is no
+    store.
+    """
+    path = _path()
+    if not os.path.exists(path):
+        return None
+    mtime = os.path.getmtime(path)
+    if _store.get('path') != path or _store.get('mtime') != mtime:
+        store = np.load(path, mmap_mode='r')
+        index = {_key(*combo): i for i, combo in enumerate(store[:, :4])}
+        _store.update(path=path, mtime=mtime, spectra=store[:, 4:], index=index)
+        _cache.clear()
+    return _store['spectra'], _store['index']
+
+
+def get(Teff, logg=4.5, FeH=0.0, aM=0.0):
+    """
+    The PHOENIX spectrum at a grid point, or None if it isn't in the store.
+    The array is shared with the cache, so it is read only.
+    """
+    key = _key(Teff, logg, FeH, aM)
+    if key in _cache:
+        spec = _cache[key]
+    else:
+        store = load()
+        if store is None or key not in store[1]:
+            return None
+        spectra, index = store
+        spec = np.array(spectra[index[key]])
+    remember(spec, Teff, logg, FeH, aM)
+    return spec
+
+
+def remember(spec, Teff, logg=4.5, FeH=0.0, aM=0.0):
+    """Keep spec in memory as the most recently used spectrum, making it read only."""
+    key = _key(Teff, logg, FeH, aM)
+    spec.flags.writeable = False
+    _cache.pop(key, None)
+    _cache[key] = spec
+    while len(_cache) > cachesize:
+        _cache.popitem(last=False)
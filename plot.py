@@ -10,14 +10,12 @@ from mypy.specutils import plot as specplot
 import rc, io, utils, db
 import numpy as np
 
-stars = rc.stars
-
 
 def texname(star):
     with open(rc.target_list_tex) as f:
         texnames = f.read().splitlines()
 
-    i = stars.index(star)
+    i = rc.stars.index(star)
     return texnames[i]
 
 def plotrange(spectbl, w0, w1, *args, **kwargs):
@@ -199,7 +197,7 @@ def getcurves():
     reload the function.
     """
     curves = []
-    for star in stars:
+    for star in rc.stars:
         tagfiles = db.findfiles('u', 'corrtag_a', 'cos_g130m', star, fullpaths=True)
         x1dfiles = db.findfiles('u', 'x1d', 'cos_g130m', star, fullpaths=True)
 
@@ -273,7 +271,7 @@ def setupAxes():
 def plotLC(stuff, colors, fname):
     setupAxes()
 
-    for (ss, yy, ee, flare, mn, offset), color, star in zip(stuff, colors, stars):
+    for (ss, yy, ee, flare, mn, offset), color, star in zip(stuff, colors, rc.stars):
         yo = yy.copy() + offset
 
 
@@ -0,0 +1,177 @@
+"""
+A reverse index of the provenance of the data products, so that when a file
+changes it is quick to find every product made from it.
+
+Products written by io.writefits (custom extractions, coadds, and panspectra)
+list their source spectra in their sourcespecs extension, and the HLSP files
+list the HST rootnames of theirs in the SRCSPECS extension. Each HLSP file is
+also made from the MUSCLES spectrum of the same name (see db.hlsppath). The
+index records these links in tables of the catalog database (rc.catalogpath)
+and rereads a product only when it has been modified.
+"""
+import os
+
+from astropy.io import fits
+
+import rc
+import db
+import catalog
+import reduce as red
+
+_schema = """
+CREATE TABLE IF NOT EXISTS products (path TEXT PRIMARY KEY, name TEXT, mtime REAL);
+CREATE TABLE IF NOT EXISTS sources (path TEXT, source TEXT, kind TEXT);
+CREATE INDEX IF NOT EXISTS sources_source ON sources (source);
+CREATE INDEX IF NOT EXISTS sources_path ON sources (path);
+"""
+
+# the stage of reduce.theworks that makes each kind of product
+stages = [['custom_spec', 'custom'], ['coadd', 'coadd'], ['panspec', 'pan'], ['hlsp_', 'hlsp']]
+
+_ready = set()
+
+
+def connect():
+    con = catalog.connect()
+    if id(con) not in _ready:
+        con.executescript(_schema)
+        _ready.add(id(con))
+    return con
+
+
+def _key(name):
+    """The name of a spectrum as it appears in a sourcespecs extension."""
+    name = os.path.basename(name)
+    return name[:-5] if name.endswith('.fits') else name
+
+
+def productfiles():
+    """Paths of all of the products that record their sources."""
+    files = []
+    for folder in rc.datafolders:
+        path = os.path.join(rc.datapath, folder)
+        if os.path.isdir(path):
+            files.extend(filter(lambda f: 'coadd' in f or 'custom' in f, db.findfiles(path, '.fits')))
+    if os.path.isdir(rc.productspath):
+        files.extend(db.findfiles(rc.productspath, 'panspec', '.fits'))
+    if os.path.isdir(rc.hlsppath):
+        files.extend(db.findfiles(rc.hlsppath, 'hlsp_', '.fits'))
+    # findfiles matches substrings, which would include e.g. '.fits.part' files
+    return filter(lambda f: f.endswith('.fits'), files)
+
+
+def _readsources(path):
+    """Return (source, kind) pairs for the sources recorded in a product file."""
+    if os.path.basename(path).startswith('hlsp_'):
+        try:
+            data = fits.getdata(path, 'srcspecs')
+        except KeyError:
+            return []
+        if 'ROOTNAME' not in data.names:
+            return []
+        return [(rootname.strip().lower(), 'srcspecs') for rootname in data['ROOTNAME']]
+    return [(_key(name), 'sourcespecs') for name in db.read_manifest(path)]
+
+
+def refresh(force=False):
+    """
+    Bring the index up to date, rereading only the products modified since
+    they were last read (all of them if force is True).
+    """
+    con = connect()
+    files = productfiles()
+    known = dict(con.execute('SELECT path, mtime FROM products'))
+    with con:
+        for path in files:
+            mtime = os.path.getmtime(path)
+            if known.get(path, None) == mtime and not force:
+                continue
+            con.execute('DELETE FROM sources WHERE path=? AND kind!=?', (path, 'hlsp'))
+            rows = [(path, source, kind) for source, kind in _readsources(path)]
+            con.executemany('INSERT INTO sources VALUES (?,?,?)', rows)
+            con.execute('INSERT OR REPLACE INTO products VALUES (?,?,?)', (path, _key(path), mtime))
+
+        # forget products that no longer exist
+        current = set(files)
+        for path in known:
+            if path not in current:
+                con.execute('DELETE FROM products WHERE path=?', (path,))
+                con.execute('DELETE FROM sources WHERE path=?', (path,))
+
+        # link each HLSP file to the spectrum it was made from
+        hlspfiles = set(filter(lambda f: os.path.basename(f).startswith('hlsp_'), files))
+        names = set([name for name, in con.execute('SELECT name FROM products')])
+        names.update([source for source, in con.execute('SELECT source FROM sources WHERE kind=?', ('sourcespecs',))])
+        rows = []
+        for name in names:
+            try:
+                hlsp = db.hlsppath(name)
+            except Exception:
+                continue # names that don't follow the convention have no HLSP file
+            if hlsp in hlspfiles:
+                rows.append((hlsp, name, 'hlsp'))
+        con.execute('DELETE FROM sources WHERE kind=?', ('hlsp',))
+        con.executemany('INSERT INTO sources VALUES (?,?,?)', rows)
+
+
+def sources(product):
+    """Names (and rootnames) of the sources recorded for a product path."""
+    rows = connect().execute('SELECT source FROM sources WHERE path=? ORDER BY source', (product,))
+    return [source for source, in rows]
+
+
+def stale(changed):
+    """
+    Paths of all of the products made, directly or through other products,
+    from the changed files (paths or spectrum names). Only reflects the index
+    as of the last refresh, so call refresh first to be sure it is complete.
+    """
+    if type(changed) is str:
+        changed = [changed]
+    con = connect()
+    keys = set()
+    for name in changed:
+        keys.add(_key(name))
+        info = db.fileinfo(_key(name))
+        if len(info.pieces) > 5 and info.observatory == 'hst':
+            keys.add(info.pieces[5])
+
+    found = set()
+    frontier = list(keys)
+    while len(frontier):
+        sql = 'SELECT DISTINCT path FROM sources WHERE source IN ({})'.format(','.join('?'*len(frontier)))
+        paths = [path for path, in con.execute(sql, frontier) if path not in found]
+        found.update(paths)
+        frontier = [_key(path) for path in paths if _key(path) not in keys]
+        keys.update(frontier)
+    return sorted(found)
+
+
+def plan_rebuild(changed):
+    """
+    The stages of reduce.theworks that must be rerun to bring the products
+    made from the changed files up to date, as a dict of star: stages.
+    """
+    result = {}
+    for path in stale(changed):
+        name = os.path.basename(path)
+        star = db.fileinfo(name).star
+        for tag, stage in stages:
+            if tag in name:
+                result.setdefault(star, set()).add(stage)
+                break
+    return {star: [s for s in red.allstages if s in needed] for star, needed in result.items()}
+
+
+def rebuild(changed, silent=False):
+    """
+    Rerun only the stages of reduce.theworks needed to remake the products
+    made from the changed files (see plan_rebuild). Returns the plan.
+    """
+    refresh()
+    plan = plan_rebuild(changed)
+    for star in sorted(plan):
+        if not silent:
+            print 'rebuilding the {} stages for {}'.format(', '.join(plan[star]), star)
+        red.theworks(star, stages=plan[star], silent=silent)
+    return plan
@@ -5,11 +5,20 @@ Created on Fri Nov 07 15:51:54 2014
 @author: Parke
 """
 import os
+import sys
+import shutil
+import copy
+import types
+import cPickle as pickle
+from contextlib import contextmanager
+from UserDict import DictMixin
+from warnings import warn
 from mypy.my_numpy import midpts
 import numpy as np
 from itertools import product as iterproduct
-from urllib import urlretrieve
-from math import ceil
+import urllib2
+import time
+from multiprocessing.pool import ThreadPool
 import json
 from astropy.io import fits
 from pandas import read_json
@@ -31,17 +40,24 @@ scratchpath = root + '/scratchwork'
 solarpath = gdrive + '/Datasets/shared/solar'
 photondir = datapath + '/photons'
 flaredir = productspath + '/flare_catalogs'
+buildpath = productspath + '/build'
+perfpath = productspath + '/perf'
+checkpointpath = productspath + '/checkpoints'
+catalogpath = local + '/file_catalog.sqlite'
+columnarpath = local + '/columnar'
 proppath = root + '/share/starprops'
 moviepath = productspath + '/movies'
 filterpath =  gdrive + '/Datasets' + '/shared/filter response curves'
+filtercachepath = local + '/filter_curves.npz'
 sharepath = root +'/share'
 xsectionpath = local + '/xsections'
 normfac_file = local + '/normfac_log.json'
+normfacpath = local + '/normfacs'
 photref_file = photometrypath + '/photometry_refs.json'
 
-starprops = sc.SciCatalog(proppath, readOnly=True, silent=True)
+snapshotpath = local + '/rc_snapshot'
+
 contbandpath = sharepath + '/continuum_bands.csv'
-contbands = np.loadtxt(contbandpath, delimiter=',')
 
 datafolders = ['x-ray', 'uv', 'visible', 'ir']
 bandmap = {'u':'uv', 'x':'x-ray', 'v':'visible', 'r':'ir'}
@@ -56,13 +72,6 @@ stdbandpath = root + '/settings/stdbands.json'
 #root = r'C:\Users\Parke\Google Drive\Research\MUSCLES'
 
 
-stars = list(starprops.values.sort_values('Teff_muscles').index)
-observed = [star for star in stars if starprops['observed'][star]]
-hosts = [star for star in stars if starprops['host'][star]]
-
-with open(normfac_file) as f:
-    normfacs = json.load(f)
-
 insolation = 1361000. # cgs
 
 # -----------------------------------------------------------------------------
@@ -91,8 +100,8 @@ phxZgrid = np.hstack([np.arange(-4.0, -2.0, 1.0),
                    np.arange(-2.0, 1.1, 0.5)])
 phxagrid = np.arange(-0.2, 1.3, 0.2)
 phxgrids = [phxTgrid, phxggrid, phxZgrid, phxagrid]
-phxwave = fits.getdata(os.path.join(phxrepo, 'wavegrid_hires.fits'))
-phxwave = np.hstack([[499.95], midpts(phxwave), [54999.875]])
+phxwavepath = os.path.join(phxrepo, 'wavegrid_hires.fits')
+phxstorepath = os.path.join(phxrepo, 'grid')
 
 
 def phxurl(Teff, logg=4.5, FeH=0.0, aM=0.0, repo='ftp'):
@@ -118,15 +127,84 @@ def phxurl(Teff, logg=4.5, FeH=0.0, aM=0.0, repo='ftp'):
 
 def fetchphxfile(Teff, logg, FeH, aM, repo=phxrepo):
     loc, ftp = [phxurl(Teff, logg, FeH, aM, repo=r) for r in [repo, 'ftp']]
-    urlretrieve(ftp, loc)
+    _fetch(ftp, loc)
+
+def _fetch(url, loc, retries=3, chunksize=2**20):
+    """
+    Download url to loc, returning the number of bytes downloaded.
+
+    The data go to loc + '.part' and the file is only renamed to loc once its
+    size matches the size reported by the server and it opens as a valid FITS
+    file, so loc is never left half written. A .part file left by an
+    interrupted download is resumed if the server supports byte ranges (HTTP)
+    and started over otherwise. Failed attempts are retried up to retries
+    times, waiting a little longer each time.
+    """
+    part = loc + '.part'
+    for attempt in range(retries + 1):
+        try:
+            start = os.path.getsize(part) if os.path.exists(part) else 0
+            request = urllib2.Request(url)
+            if start > 0:
+                request.add_header('Range', 'bytes={}-'.format(start))
+            response = urllib2.urlopen(request, timeout=60)
+            try:
+                if start > 0 and response.getcode() != 206:
+                    start = 0 # the server sent the whole file
+                length = response.info().getheader('Content-Length')
+                expected = None if length is None else start + int(length)
+                with open(part, 'ab' if start > 0 else 'wb') as f:
+                    while True:
+                        chunk = response.read(chunksize)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+            finally:
+                response.close()
+
+            size = os.path.getsize(part)
+            if expected is not None and size != expected:
+                raise IOError('Downloaded {} bytes of {} from {}.'.format(size, expected, url))
+            if not _isfits(part):
+                os.remove(part) # corrupt, so start over
+                raise IOError('{} is not a valid FITS file.'.format(url))
+            os.rename(part, loc)
+            return size - start
+        except Exception as e:
+            if isinstance(e, urllib2.HTTPError) and e.code == 416 and os.path.exists(part):
+                os.remove(part) # the partial file can't be resumed, so start over
+            if attempt == retries:
+                raise
+            time.sleep(2**attempt)
+
+def _isfits(path):
+    """Whether the file at path opens as a valid FITS file with readable data."""
+    try:
+        with fits.open(path) as hdus:
+            hdus.verify('exception')
+            hdus[0].data
+        return True
+    except Exception:
+        return False
 
 def fetchphxfiles(Trng=[2500,3500], grng=[4.0,5.5], FeHrng=[0.0, 0.0],
-                  aMrng=[0.0, 0.0], repo=phxrepo):
+                  aMrng=[0.0, 0.0], repo=phxrepo, jobs=4, retries=3, verify=True, silent=False):
     """
     Download all Phoenix spectra covering the provided ranges. Does not
-    re-download files that already exist in the directory.
+    re-download files that already exist in the directory, unless verify is
+    True and they don't open as valid FITS files (e.g. files truncated by a
+    download made before they were checked). Set verify to False to skip
+    reading every existing file.
 
     Default values are from UV variability sample properties.
+
+    Files are downloaded by jobs threads at once and each is verified before
+    it is moved into place (see _fetch), so an interrupted run can simply be
+    run again to pick up where it left off. To fetch from somewhere else
+    (e.g. a local mirror), set phoenixbaseurl, as in
+    `with rc.using(phoenixbaseurl='http://localhost:8000/'):`.
+
+    Returns a list of (url, error message) for the files that failed.
     """
     def makerng(x, grid):
         if not hasattr(x, '__iter__'):
@@ -144,20 +222,50 @@ def fetchphxfiles(Trng=[2500,3500], grng=[4.0,5.5], FeHrng=[0.0, 0.0],
     paths = []
     for combo in combos:
         locpath = phxurl(*combo, repo=repo)
-        if not os.path.exists(locpath):
-            paths.append((locpath, phxurl(*combo, repo='ftp')))
+        if os.path.exists(locpath):
+            if not verify or _isfits(locpath):
+                continue
+            if not silent:
+                print '{} is corrupt and will be downloaded again'.format(os.path.basename(locpath))
+        paths.append((locpath, phxurl(*combo, repo='ftp')))
 
     N = len(paths)
     datasize = N*6.0/1024.0
-    print ('Beginning download of {} files, {:.3f} Gb. Ctrl-C to stop.'
-           ''.format(N,datasize))
-    print 'Progress bar (- = 5%):\n'
+    if not silent:
+        print ('Beginning download of {} files, {:.3f} Gb with {} at a time. Ctrl-C to stop.'
+               ''.format(N, datasize, jobs))
 
-    Nbar = ceil(N/20.0)
-    for i,(loc, ftp) in enumerate(paths):
-        if i % Nbar == 0:
-            print '-',
-        urlretrieve(ftp,loc)
+    def work(path):
+        loc, url = path
+        try:
+            return url, _fetch(url, loc, retries=retries), ''
+        except Exception as e:
+            return url, 0, '{}: {}'.format(type(e).__name__, e)
+
+    failed = []
+    nbytes = 0
+    begin = time.time()
+    pool = ThreadPool(jobs)
+    try:
+        for i, (url, size, error) in enumerate(pool.imap_unordered(work, paths)):
+            nbytes += size
+            if error:
+                failed.append((url, error))
+            if not silent:
+                rate = nbytes / 2.0**20 / max(time.time() - begin, 1e-3)
+                status = 'failed, ' + error if error else 'ok'
+                print '[{}/{}] {} {} ({:.1f} MB/s)'.format(i+1, N, os.path.basename(url), status, rate)
+                sys.stdout.flush()
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    if not silent and len(failed):
+        print '{} of {} files failed. Run again to retry them.'.format(len(failed), N)
+    return failed
 
 def phxpath(star):
     """Standard name for interpolated phoenix spectrum."""
@@ -168,7 +276,6 @@ def phxpath(star):
 # AIRGLOW LINES
 
 airglow_path = os.path.join(root, 'airglow_ranges.csv')
-airglow_ranges = np.loadtxt(airglow_path, delimiter=',')
 
 # -----------------------------------------------------------------------------
 # "SETTINGS"
@@ -181,7 +288,7 @@ def seriousdqs(path_or_insti, from_x1d_header=True):
         path = getinststr(path_or_insti)
     if '_cos_' in path:
         if from_x1d_header:
-            return fits.getval(path, 'sdqflags', 1)
+            return _x1d_sdqflags(path)
         else:
             if ('g130m' in path) or ('g160m' in path):
                 return 8344
@@ -193,6 +300,42 @@ def seriousdqs(path_or_insti, from_x1d_header=True):
         return (800 | 700 | 400 | 300 | 200 | 100 | 16)
     raise NotImplementedError('No serious dq flags defined for config\n{}'.format(path))
 
+_sdqflags_cache = {}
+
+def _x1d_sdqflags(path):
+    """The sdqflags value in the header of an x1d file, read only once per file (unless it is modified)."""
+    mtime = os.path.getmtime(path)
+    if path not in _sdqflags_cache or _sdqflags_cache[path][0] != mtime:
+        _sdqflags_cache[path] = mtime, fits.getval(path, 'sdqflags', 1)
+    return _sdqflags_cache[path][1]
+
+_seriousdq_table = None
+
+def seriousdq_masks(insts):
+    """
+    The serious dq flags for each element of an array of instrument
+    identifiers, e.g. the instrument column of a spectbl, using the default
+    flags for each instrument (see seriousdqs with from_x1d_header=False).
+    """
+    global _seriousdq_table
+    if _seriousdq_table is None:
+        masks = []
+        for val in instvals:
+            try:
+                masks.append(seriousdqs(val, from_x1d_header=False))
+            except NotImplementedError:
+                masks.append(-1)
+        _seriousdq_table = np.array(instvals), np.array(masks)
+    vals, masks = _seriousdq_table
+
+    insts = np.asarray(insts)
+    i = np.clip(np.searchsorted(vals, insts), 0, len(vals) - 1)
+    bad = (vals[i] != insts) | (masks[i] < 0)
+    if np.any(bad):
+        # let seriousdqs raise the usual error for the offending instrument
+        seriousdqs(insts[bad][0], from_x1d_header=False)
+    return masks[i]
+
 spectbl_format =  {'units' : ['Angstrom']*2 + ['erg/s/cm2/Angstrom']*2 + ['s','','','','d','d'],
                    'dtypes' : ['f8']*5 + ['i2', 'i4'] + ['f8']*3,
                    'fmts' : ['.2f']*2 + ['.2e']*2 + ['.1f', 'b', 'd', '.2f', '.2f', '.2f'],
@@ -210,8 +353,6 @@ spectbl_format =  {'units' : ['Angstrom']*2 + ['erg/s/cm2/Angstrom']*2 + ['s',''
                    'colnames' : ['w0','w1','flux','error','exptime','flags',
                                  'instrument','normfac','minobsdate','maxobsdate']}
 
-stdbands = read_json(stdbandpath)
-
 # prenormed = ['mod_lya', 'mod_euv', 'cos_g130m', 'cos_g160m', 'sts_g430l', 'sts_g430m', 'mod_apc']
 prenormed = ['mod_lya', 'mod_euv', 'cos_g130m', 'cos_g160m', 'cos_g230l', 'mod_phx', 'mod_apc']
 normranges = {'hst_sts_g430l':[3500., 5700.]}
@@ -326,10 +467,12 @@ class StarSettings:
         self.prenormed = []
         self.weird_norm = {}
         self.order = []
+        self._index = {}
 
     def add_wave_offset(self, config, offset):
         self.wave_offsets['configs'].append(config)
         self.wave_offsets['offsets'].append(offset)
+        self._index = {}
 
     def add_tag_extraction(self, config, **kwds):
         """Add a custom extraction for the tags as a config string and then kwds to provide
@@ -342,27 +485,40 @@ class StarSettings:
         to the custom extraction function in reduce."""
         d = {'config' : config, 'kwds' : kwds}
         self.custom_extractions.append(d)
+        self._index = {}
 
     def add_custom_range(self, config, ranges):
         """Add good wavelength range for a spectrum."""
         self.custom_ranges['configs'].append(config)
         self.custom_ranges['ranges'].append(ranges)
+        self._index = {}
 
     def add_norm_range(self, config, ranges):
         """Add good wavelength range for a spectrum."""
         self.norm_ranges['configs'].append(config)
         self.norm_ranges['ranges'].append(ranges)
+        self._index = {}
+
+    def _position(self, field, config):
+        """
+        Return the position of the entry of field (e.g. 'norm_ranges') whose
+        config is in config, or None if there is none. The positions are
+        remembered for each field and config since the same configs are
+        looked up over and over, and loadsettings shares them between the
+        copies it makes. They are forgotten whenever a setting is added.
+        """
+        configs = getattr(self, field)['configs']
+        key = field, config, len(configs)
+        if key not in self._index:
+            matches = [i for i, s in enumerate(configs) if s in config]
+            if len(matches) > 1:
+                raise ValueError('multiple {} matches'.format(field[:-1].replace('_', ' ')))
+            self._index[key] = matches[0] if len(matches) else None
+        return self._index[key]
 
     def get_wave_offset(self, config):
-        configmatch = lambda s: s in config
-        configs = filter(configmatch, self.wave_offsets['configs'])
-        if len(configs) > 1:
-            raise ValueError('multiple wave offset matches')
-        elif len(configs) == 1:
-            i = self.wave_offsets['configs'].index(configs[0])
-            return self.wave_offsets['offsets'][i]
-        else:
-            return None
+        i = self._position('wave_offsets', config)
+        return None if i is None else self.wave_offsets['offsets'][i]
 
     def get_custom_extraction(self, config):
         configmatch = lambda s: config in s['config']
@@ -382,39 +538,49 @@ class StarSettings:
             return None
 
     def get_custom_range(self, config):
-        configmatch = lambda s: s in config
-        configs = filter(configmatch, self.custom_ranges['configs'])
-        if len(configs) > 1:
-            raise ValueError('multiple custom range matches')
-        elif len(configs) == 1:
-            i = self.custom_ranges['configs'].index(configs[0])
-            return np.reshape(self.custom_ranges['ranges'][i], [-1, 2])
-        else:
-            return None
+        i = self._position('custom_ranges', config)
+        return None if i is None else np.reshape(self.custom_ranges['ranges'][i], [-1, 2])
 
     def get_norm_range(self, config):
-        configmatch = lambda s: s in config
-        configs = filter(configmatch, self.norm_ranges['configs'])
-        if len(configs) > 1:
-            raise ValueError('multiple custom range matches')
-        elif len(configs) == 1:
-            i = self.norm_ranges['configs'].index(configs[0])
-            return np.reshape(self.norm_ranges['ranges'][i], [-1, 2])
-        else:
-            return None
+        i = self._position('norm_ranges', config)
+        return None if i is None else np.reshape(self.norm_ranges['ranges'][i], [-1, 2])
 
     def add_reject(self, config, i=0):
         """Add a spectrum to the reject list as a config string and number
         specifying the segment/order to reject."""
         self.reject_specs.append([config, i])
 
+    def todict(self):
+        """The settings as a dict, as they are saved."""
+        return {key: value for key, value in self.__dict__.items() if not key.startswith('_')}
+
     def save(self):
         path = settingspath(self.star)
         with open(path, 'w') as f:
-            json.dump(self.__dict__, f)
+            json.dump(self.todict(), f)
+
+_settings_cache = {}
 
 def loadsettings(star):
+    """
+    Load the settings for star. Each settings file is only parsed again if it
+    has been modified, but a new copy of the settings is returned every time
+    so that changes to it don't carry over to other callers. The copies
+    share the positions found by their lookups (see StarSettings._position).
+    """
     path = settingspath(star)
+    try:
+        stat = os.stat(path)
+    except OSError as e:
+        raise IOError(e.errno, e.strerror, path)
+    version = stat.st_mtime, stat.st_size
+    if path not in _settings_cache or _settings_cache[path][0] != version:
+        _settings_cache[path] = version, _parsesettings(star, path)
+    cached = _settings_cache[path][1]
+    # the memo makes deepcopy use the cached index itself rather than copying it
+    return copy.deepcopy(cached, {id(cached._index): cached._index})
+
+def _parsesettings(star, path):
     with open(path) as f:
         d = json.load(f)
     def safeget(key):
@@ -454,10 +620,274 @@ def getbands(v0, v1, centers):
         i_delete, = np.nonzero(r[:-1] >= l[1:])
         bands = np.array([np.delete(l, i_delete+1), np.delete(r, i_delete)]).T
     return bands
-
-line_bands = {}
-for key in line_centers:
-    line_bands[key] = getbands(-band_dv, band_dv, line_centers[key])
-line_bands['lya'] = [lyacut]
 #endregion
 
+
+@contextmanager
+def using(**values):
+    """
+    Temporarily set module attributes (e.g. paths) to the provided values,
+    as in `with rc.using(datapath='/tmp/data'):`. Lazily loaded attributes
+    that are replaced go back to being unloaded afterwards.
+
+    Lazily loaded attributes read from a path that is replaced (see
+    _lazypaths) are unloaded within the block, so they are loaded from the
+    new path if used, and are put back as they were afterwards.
+    """
+    attrs = globals()
+    names = list(values)
+    names += [name for name, paths in _lazypaths.items()
+              if name not in values and any([p in values for p in paths])]
+    old = {name: attrs[name] for name in names if name in attrs}
+    for name in names:
+        attrs.pop(name, None)
+    attrs.update(values)
+    try:
+        yield
+    finally:
+        for name in names:
+            if name in old:
+                attrs[name] = old[name]
+            else:
+                attrs.pop(name, None)
+
+
+@contextmanager
+def atomic_write(path, suffix=''):
+    """
+    Write a file (or folder) so that it is never seen half written, as in
+
+        with rc.atomic_write(path) as tmp:
+            with open(tmp, 'w') as f:
+                ...
+
+    The block writes to tmp, a name in the same folder as path, which is
+    moved to path if the block finishes and removed if it fails. tmp starts
+    with '.tmp' and doesn't contain the name of path, so searches for files
+    by name don't find it. suffix is appended to tmp for writers that add
+    their own extension otherwise (e.g. '.npz' for np.savez).
+    """
+    tmp = os.path.join(os.path.dirname(os.path.abspath(path)),
+                       '.tmp{}{}{}'.format(os.getpid(), os.urandom(4).encode('hex'), suffix))
+    try:
+        yield tmp
+        os.rename(tmp, path)
+    finally:
+        if os.path.isdir(tmp):
+            shutil.rmtree(tmp, ignore_errors=True)
+        elif os.path.exists(tmp):
+            os.remove(tmp)
+
+# -----------------------------------------------------------------------------
+# NORMALIZATION FACTORS
+
+class NormfacStore(DictMixin):
+    """
+    The normalization factors found for each star by reduce.panspectrum as a
+    mapping of star: {instrument: [normfac, error]}.
+
+    Each star's factors are kept in their own json file in folder and are
+    replaced with a single rename when they are set, so any number of
+    processes can reduce different stars and read the factors at once. Stars
+    without a file are looked up in the old single-file log, legacy_file.
+
+    Dicts returned by the store are copies, so changing them has no effect
+    until they are set again.
+    """
+    def __init__(self, folder, legacy_file=None):
+        self.folder = folder
+        self.legacy_file = legacy_file
+        self._cache = {}
+
+    def path(self, star):
+        return os.path.join(self.folder, star + '.json')
+
+    def _legacy(self):
+        if self.legacy_file is None or not os.path.exists(self.legacy_file):
+            return {}
+        with open(self.legacy_file) as f:
+            return json.load(f)
+
+    def __getitem__(self, star):
+        try:
+            stat = os.stat(self.path(star))
+        except OSError:
+            return self._legacy()[star]
+        version = stat.st_ino, stat.st_mtime
+        if star not in self._cache or self._cache[star][0] != version:
+            with open(self.path(star)) as f:
+                self._cache[star] = version, json.load(f)
+        return dict(self._cache[star][1])
+
+    def __setitem__(self, star, facs):
+        try:
+            os.makedirs(self.folder)
+        except OSError:
+            if not os.path.isdir(self.folder):
+                raise
+        with atomic_write(self.path(star)) as tmp:
+            with open(tmp, 'w') as f:
+                json.dump(facs, f)
+
+    def __delitem__(self, star):
+        try:
+            os.remove(self.path(star))
+        except OSError:
+            raise KeyError(star)
+        self._cache.pop(star, None)
+
+    def keys(self):
+        stars = set(self._legacy().keys())
+        if os.path.isdir(self.folder):
+            stars.update([name[:-5] for name in os.listdir(self.folder) if name.endswith('.json')])
+        return sorted(stars)
+
+    def export(self, path=None):
+        """Write the factors for all stars to a single file like the old log (legacy_file by default)."""
+        if path is None:
+            path = self.legacy_file
+        with atomic_write(path) as tmp:
+            with open(tmp, 'w') as f:
+                json.dump(dict(self.items()), f)
+
+normfacs = NormfacStore(normfacpath, legacy_file=normfac_file)
+
+# -----------------------------------------------------------------------------
+# LAZY LOADING
+# The star catalog and tables are not loaded on import, but the
+# first time they are accessed as attributes of this module (e.g. rc.stars).
+# Use snapshot() to save binary copies of the catalog and tables that are
+# faster to load than the originals. A snapshot is ignored if any of its
+# sources have been modified since it was made.
+
+def _loaded(name):
+    """Get a (possibly lazily loaded) attribute of this module."""
+    return getattr(sys.modules[__name__], name)
+
+
+def _mtime(path):
+    """Modification time of a file or the latest of a folder and its contents."""
+    if os.path.isdir(path):
+        names = [os.path.join(path, name) for name in os.listdir(path)]
+        return max([os.path.getmtime(path)] + map(_mtime, names))
+    return os.path.getmtime(path)
+
+
+def _snapshotted(name, sources, load):
+    """Load name from its snapshot if it is newer than all of its sources, otherwise by calling load."""
+    path = os.path.join(snapshotpath, name + '.pkl')
+    try:
+        if os.path.getmtime(path) > max(map(_mtime, sources)):
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+    except (OSError, IOError, EOFError, pickle.UnpicklingError):
+        pass
+    return load()
+
+
+def _load_starprops():
+    load = lambda: sc.SciCatalog(proppath, readOnly=True, silent=True)
+    return _snapshotted('starprops', [proppath], load)
+
+
+def _load_stars():
+    return list(_loaded('starprops').values.sort_values('Teff_muscles').index)
+
+
+def _load_observed():
+    starprops = _loaded('starprops')
+    return [star for star in _loaded('stars') if starprops['observed'][star]]
+
+
+def _load_hosts():
+    starprops = _loaded('starprops')
+    return [star for star in _loaded('stars') if starprops['host'][star]]
+
+
+def _load_contbands():
+    load = lambda: np.loadtxt(contbandpath, delimiter=',')
+    return _snapshotted('contbands', [contbandpath], load)
+
+
+def _load_phxwave():
+    def load():
+        phxwave = fits.getdata(phxwavepath)
+        return np.hstack([[499.95], midpts(phxwave), [54999.875]])
+    return _snapshotted('phxwave', [phxwavepath], load)
+
+
+def _load_airglow_ranges():
+    load = lambda: np.loadtxt(airglow_path, delimiter=',')
+    return _snapshotted('airglow_ranges', [airglow_path], load)
+
+
+def _load_stdbands():
+    return _snapshotted('stdbands', [stdbandpath], lambda: read_json(stdbandpath))
+
+
+def _load_line_bands():
+    line_bands = {}
+    for key in line_centers:
+        line_bands[key] = getbands(-band_dv, band_dv, line_centers[key])
+    line_bands['lya'] = [lyacut]
+    return line_bands
+
+
+_lazy = {'starprops': _load_starprops, 'stars': _load_stars, 'observed': _load_observed, 'hosts': _load_hosts,
+         'contbands': _load_contbands, 'phxwave': _load_phxwave,
+         'airglow_ranges': _load_airglow_ranges, 'stdbands': _load_stdbands, 'line_bands': _load_line_bands}
+_snapshots = ['starprops', 'contbands', 'phxwave', 'airglow_ranges', 'stdbands']
+# the paths each lazily loaded attribute is read from (see using)
+_lazypaths = {'starprops': ['proppath', 'snapshotpath'], 'stars': ['proppath', 'snapshotpath'],
+              'observed': ['proppath', 'snapshotpath'], 'hosts': ['proppath', 'snapshotpath'],
+              'contbands': ['contbandpath', 'snapshotpath'], 'phxwave': ['phxwavepath', 'snapshotpath'],
+              'airglow_ranges': ['airglow_path', 'snapshotpath'], 'stdbands': ['stdbandpath', 'snapshotpath']}
+
+
+def snapshot():
+    """
+    Save binary snapshots of the star catalog and tables to snapshotpath so
+    that they load quickly in later sessions.
+    """
+    if not os.path.exists(snapshotpath):
+        os.makedirs(snapshotpath)
+    for name in _snapshots:
+        path = os.path.join(snapshotpath, name + '.pkl')
+        try:
+            with atomic_write(path) as tmp:
+                with open(tmp, 'wb') as f:
+                    pickle.dump(_loaded(name), f, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError) as e:
+            warn('Could not snapshot {}: {}'.format(name, e))
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stands in for a module, passing all attribute access through to it, except
+    that the attributes in loaders (a dict of name: function) are created by
+    calling their function the first time they are accessed.
+    """
+    def __init__(self, module, loaders):
+        types.ModuleType.__init__(self, module.__name__, module.__doc__)
+        self.__dict__['_module'] = module
+        self.__dict__['_loaders'] = loaders
+
+    def __getattr__(self, name):
+        attrs = self._module.__dict__
+        if name not in attrs and name in self._loaders:
+            attrs[name] = self._loaders[name]()
+        try:
+            return attrs[name]
+        except KeyError:
+            raise AttributeError("'module' object has no attribute '{}'".format(name))
+
+    def __setattr__(self, name, value):
+        setattr(self._module, name, value)
+
+    def __delattr__(self, name):
+        delattr(self._module, name)
+
+    def __dir__(self):
+        return sorted(set(self._module.__dict__) | set(self._loaders))
+
+sys.modules[__name__] = LazyModule(sys.modules[__name__], _lazy)
@@ -9,7 +9,6 @@ import os
 from math import sqrt
 from itertools import combinations_with_replacement as combos
 from warnings import warn
-import json
 
 import numpy as np
 from astropy.table import Table, vstack
@@ -21,21 +20,56 @@ import scipy.optimize as opt
 
 import mypy.my_numpy as mnp
 from mypy import specutils, pdfutils
-import rc, utils, io, check, db
+import rc, utils, io, check, db, build, perf, checkpoint, filters
 from spectralPhoton.hst import x2dspec
 import spectralPhoton as sp
 import matplotlib.pyplot as plt
 
 colnames = rc.spectbl_format['colnames']
-airglow_ranges = rc.airglow_ranges
-keep = ~((1215.67 > airglow_ranges[:,0]) & (1215.67 < airglow_ranges[:,1]))
-airglow_ranges = airglow_ranges[keep]
-safe_ranges = [0.0] + list(airglow_ranges.ravel()) + [np.inf]
-safe_ranges = np.reshape(safe_ranges, [len(airglow_ranges) + 1, 2])
 lyacut = rc.lyacut
+
+
+def airglow_safe_ranges():
+    """Wavelength ranges free of airglow lines other than Lya."""
+    airglow_ranges = rc.airglow_ranges
+    keep = ~((1215.67 > airglow_ranges[:,0]) & (1215.67 < airglow_ranges[:,1]))
+    airglow_ranges = airglow_ranges[keep]
+    safe_ranges = [0.0] + list(airglow_ranges.ravel()) + [np.inf]
+    return np.reshape(safe_ranges, [len(airglow_ranges) + 1, 2])
+
 haw_fit_ranges = [[1215.67-5, (1 - 300/3e5)*1215.67], [(1 + 300/3e5)*1215.67, 1217.5], [1219.25, 1215.67+5]]
 
-def theworks(star, newphx=False, silent=False):
+allstages = ['phx', 'custom', 'coadd', 'pan', 'hlsp', 'flares']
+
+def theworks(star, newphx=False, silent=False, incremental=False, resume=False, stages=None):
+    """
+    Make all of the data products for a star: interpolated phoenix spectrum,
+    custom extractions, coadds, panspectra, and HLSP files.
+
+    stages is a list of the stages to run, from allstages. By default, all
+    but 'phx' (unless newphx is True) and 'flares' are run.
+
+    If incremental is True, any stage whose inputs (source files, settings,
+    constants, and code) are unchanged since it was last run is skipped. See
+    the build module.
+
+    If instrumentation is enabled (see the perf module), a report of the time
+    and resources used by each stage is written for the star.
+
+    Each stage (and the intermediate spectra of panspectrum) is checkpointed
+    as it finishes, after any files it is writing in the background (see
+    io.asyncwrites) are written. If resume is True, the stages that finished in a previous
+    run that didn't complete are skipped. See the checkpoint module.
+    """
+    if stages is None:
+        stages = ['phx', 'custom', 'coadd', 'pan', 'hlsp'] if newphx else ['custom', 'coadd', 'pan', 'hlsp']
+    unknown = [stage for stage in stages if stage not in allstages]
+    if len(unknown):
+        raise ValueError('Unknown stages {}. Stages are {}.'.format(unknown, allstages))
+
+    perf.reset()
+    if not resume:
+        checkpoint.clear(star)
 
     try:
         rc.loadsettings(star)
@@ -44,27 +78,51 @@ def theworks(star, newphx=False, silent=False):
         sets = rc.StarSettings(star)
         sets.save()
 
-    # interpolate and save phoenix spectrum
-    if newphx:
+    def run(stage, func, *args, **kwargs):
+        if stage not in stages:
+            if not silent: print '\n\nskipping the {} stage bc you said not to'.format(stage)
+            return
+        if resume and checkpoint.done(star, stage):
+            if not silent: print '\n\nthe {} stage finished in a previous run for {}, skipping'.format(stage, star)
+            return
+        with perf.stage(stage):
+            if incremental and stage in build.stages:
+                build.run(star, stage, lambda: func(*args, **kwargs), silent=silent)
+            else:
+                func(*args, **kwargs)
+        checkpoint.mark(star, stage)
+
+    try:
+        # interpolate and save phoenix spectrum
         if not silent: print '\n\ninterpolating phoenix spectrum'
-        auto_phxspec(star, silent=silent)
-    else:
-        if not silent: print '\n\nnot interpolating new phoenix spectrum bc you said not to'
+        run('phx', auto_phxspec, star, silent=silent)
 
-    # make custom extractions
-    if not silent: print '\n\nperforming any custom extractions'
-    auto_customspec(star, silent=silent)
+        # make custom extractions
+        if not silent: print '\n\nperforming any custom extractions'
+        run('custom', auto_customspec, star, silent=silent)
 
-    # coadd spectra
-    if not silent: print '\n\ncoadding spectra'
-    auto_coadd(star, silent=silent)
+        # coadd spectra
+        if not silent: print '\n\ncoadding spectra'
+        run('coadd', auto_coadd, star, silent=silent)
 
-    # make panspectrum
-    if not silent: print '\n\nstitching spectra together'
-    panspectrum(star, silent=silent)  # panspec and Rspec
+        # make panspectrum
+        if not silent: print '\n\nstitching spectra together'
+        run('pan', panspectrum, star, silent=silent, resume=resume, checkpoints=True)  # panspec and Rspec
 
-    # write hlsp
-    io.writehlsp(star, overwrite=True)
+        # write hlsp
+        run('hlsp', io.writehlsp, star, overwrite=True)
+
+        # find flares
+        if not silent: print '\n\nfinding flares'
+        run('flares', auto_broadflares, star, silent=silent)
+    finally:
+        try:
+            io.flush()
+        finally:
+            # also report a failed run, which is when the report is most useful
+            if perf.enabled:
+                perf.report(star)
+    checkpoint.clear(star)
 
 
 def adaptive_rebin_pans(star, overwrite=False):
@@ -77,17 +135,97 @@ def adaptive_rebin_pans(star, overwrite=False):
     [io.writehlsp(spec, components=False, overwrite=overwrite) for spec in [adapt, over]]
 
 
-def panspectrum(star, savespecs=True, plotnorms=False, silent=False, phxnormerr='constSN'):
+def panspectrum(star, savespecs=True, plotnorms=False, silent=False, phxnormerr='constSN', resume=False,
+                checkpoints=False):
     """
     Coadd and splice the provided spectra into one panchromatic spectrum
     sampled at the native resolutions and constant R.
 
     Overlapping spectra will be normalized with the assumptions that they are
     listed in order of descending quality.
+
+    The normalization factors are recorded in rc.normfacs all at once after
+    the spectra are stitched together if savespecs is True.
+
+    If checkpoints is True (as it is when called by theworks), the stitched
+    spectrum (before Lya is spliced in) and the gap-filled spectrum are
+    checkpointed. If resume is True, the reduction picks up from the latest
+    of these checkpoints, if any.
+    """
+    if resume and checkpoint.done(star, 'filled'):
+        if not silent:
+            print 'resuming {} from the gap-filled spectrum checkpoint'.format(star)
+        spec = checkpoint.readspec(star, 'filled')
+        lntz_params = checkpoint.data(star, 'filled')['lntz_params']
+    else:
+        if resume and checkpoint.done(star, 'stitched'):
+            if not silent:
+                print 'resuming {} from the stitched spectrum checkpoint'.format(star)
+            spec, lyaspec = [checkpoint.readspec(star, name) for name in ['stitched', 'lya']]
+            state = checkpoint.data(star, 'stitched')
+            lntz_params, normfacs = state['lntz_params'], state['normfacs']
+        else:
+            spec, lyaspec, lntz_params, normfacs = _stitch(star, plotnorms, silent, phxnormerr)
+            if lntz_params is not None:
+                lntz_params = list(lntz_params)
+            if checkpoints:
+                checkpoint.savespec(star, 'stitched', spec)
+                checkpoint.savespec(star, 'lya', lyaspec)
+                checkpoint.mark(star, 'stitched', lntz_params=lntz_params, normfacs=normfacs)
+        if savespecs:
+            rc.normfacs[star] = normfacs
+
+        with perf.stage('splice lya'):
+            spec = splice(spec, lyaspec)
+
+        # fill any remaining gaps
+        order, span = rc.gap_fit_order, rc.gap_fit_span
+        if not silent:
+            print ('filling in any gaps with an order {} polynomial fit to an '
+                   'area {}x the gap width'.format(order, span))
+        with perf.stage('fill_gaps'):
+            spec = fill_gaps(spec, fill_with=order, fit_span=span, silent=silent, mingapR=10.0)
+
+        if checkpoints:
+            checkpoint.savespec(star, 'filled', spec)
+            checkpoint.mark(star, 'filled', lntz_params=lntz_params)
+
+    spec.meta['NAME'] = db.parse_name(db.panpath(star))
+    spec.meta['LNZ_NORM'], spec.meta['LNZ_GAM'] = lntz_params
+
+    assert not utils.hasgaps(spec)
+
+    # resample at constant dw
+    dw = rc.panres
+    if not silent:
+        print ('creating resampled panspec at dw = {:.1f} AA'.format(dw))
+    with perf.stage('evenbin'):
+        dspec = utils.evenbin(spec, dw)
+
+    # save to fits
+    if savespecs:
+        paths = [db.panpath(star), db.dpanpath(star, dw)]
+        if not silent:
+            print 'saving spectra to \n' + '\n\t'.join(paths)
+        with perf.stage('writefits'):
+            for s, path in zip([spec, dspec], paths):
+                io.writefits(s, path, overwrite=True)
+
+    return spec
+
+
+def _stitch(star, plotnorms, silent, phxnormerr):
+    """
+    Normalize and splice together the source spectra for star and prepare
+    the Lya spectrum to be spliced in. Returns the stitched spectrum, the Lya
+    spectrum, the parameters of the Lorentzian fit to the Lya wings (None if
+    the Lya spectrum is STIS data), and the normalization factors.
     """
     sets = rc.loadsettings(star)
+    normfacs = {}
 
-    specs, lyaspec = io.read_panspec_sources(star)
+    with perf.stage('read sources'):
+        specs, lyaspec = io.read_panspec_sources(star)
 
     names = [s.meta['NAME'] for s in specs]
 
@@ -127,7 +265,7 @@ def panspectrum(star, savespecs=True, plotnorms=False, silent=False, phxnormerr=
         print '\n\tremoving airglow from G130M spectrum'
     for i in range(len(specs)):
         if 'cos_g130m' in names[i]:
-            specs[i] = utils.keepranges(specs[i], safe_ranges)
+            specs[i] = utils.keepranges(specs[i], airglow_safe_ranges())
             # CLOOGE: remove some of g140m or e140m so it isn't used from 1198-lya
         #        if 'sts_e140m' in names[i] or 'sts_g140m' in names[i]:
         #            keep = [[0.0, safe_ranges[3,0]], [safe_ranges[3,1], np.inf]]
@@ -144,10 +282,12 @@ def panspectrum(star, savespecs=True, plotnorms=False, silent=False, phxnormerr=
     if 'mod_phx_-----' not in sets.weird_norm:
         if not silent: print 'normalizing phoenix to photometry'
         iphx = index('phx')
-        phxnorm, phxerr = norm2photometry(specs[iphx], silent=silent, plotfit=False, clean=True, err=phxnormerr)
+        with perf.stage('norm2photometry'):
+            phxnorm, phxerr = norm2photometry(specs[iphx], silent=silent, plotfit=False, clean=True,
+                                              err=phxnormerr)
         specs[iphx]['flux'] *= phxnorm
         specs[iphx]['normfac'] = phxnorm
-        rc.normfacs[star]['mod_phx_-----'] = phxnorm, phxerr
+        normfacs['mod_phx_-----'] = phxnorm, phxerr
         if 'mod_phx_-----' not in sets.prenormed:
             sets.prenormed.append('mod_phx_-----')
 
@@ -180,62 +320,61 @@ def panspectrum(star, savespecs=True, plotnorms=False, silent=False, phxnormerr=
             print ''
             print 'splicing in {}, covering {:.1f}-{:.1f}'.format(name, *specrange)
 
-        inst = db.parse_instrument(name)
-        if not rc.dontnormalize(addspec):
-            if inst in sets.weird_norm:
-                refinst_or_fac = sets.weird_norm[inst]
-                if type(refinst_or_fac) is str:
-                    refinst = refinst_or_fac
-                    if not silent:
-                        print 'normalizing {} spec using the same factor as that used for the {} spec'.format(inst, refinst)
-                    refspec = filter(lambda spec: refinst in spec.meta['NAME'], specs)
-                    assert len(refspec) == 1
-                    refspec = refspec[0]
-                    normfac, normerr = refspec[0]['normfac'], np.nan
+        with perf.stage('splice ' + name):
+            inst = db.parse_instrument(name)
+            if not rc.dontnormalize(addspec):
+                if inst in sets.weird_norm:
+                    refinst_or_fac = sets.weird_norm[inst]
+                    if type(refinst_or_fac) is str:
+                        refinst = refinst_or_fac
+                        if not silent:
+                            print 'normalizing {} spec using the same factor as that used for the {} spec'.format(inst, refinst)
+                        refspec = filter(lambda spec: refinst in spec.meta['NAME'], specs)
+                        assert len(refspec) == 1
+                        refspec = refspec[0]
+                        normfac, normerr = refspec[0]['normfac'], np.nan
+                    else:
+                        print 'normalizing {} inst by {} as sepcified in sets.werid_norm for this star.'.format(inst, refinst_or_fac)
+                        normfac, normerr = refinst_or_fac, np.nan
                 else:
-                    print 'normalizing {} inst by {} as sepcified in sets.werid_norm for this star.'.format(inst, refinst_or_fac)
-                    normfac, normerr = refinst_or_fac, np.nan
-            else:
-                overlap = utils.overlapping(spec, addspec)
-                if not overlap:
-                    normfac, normerr = 1.0, np.nan
-                    if not silent:
-                        print '\tno overlap, so won\'t normalize'
-                if overlap:
-                    if not silent:
-                        print '\tnormalizing within the overlap'
-                    normranges = sets.get_norm_range(name)
-                    config = db.parse_info(name, 1, 4)
-                    if config in rc.normranges:
+                    overlap = utils.overlapping(spec, addspec)
+                    if not overlap:
+                        normfac, normerr = 1.0, np.nan
+                        if not silent:
+                            print '\tno overlap, so won\'t normalize'
+                    if overlap:
+                        if not silent:
+                            print '\tnormalizing within the overlap'
+                        normranges = sets.get_norm_range(name)
+                        config = db.parse_info(name, 1, 4)
+                        if config in rc.normranges:
+                            if normranges is None:
+                                normranges = rc.normranges[config]
+                            else:
+                                raise ValueError('Uh oh. Conflicting norm ranges. One in rc and one in star settings.')
                         if normranges is None:
-                            normranges = rc.normranges[config]
+                            normspec = addspec
                         else:
-                            raise ValueError('Uh oh. Conflicting norm ranges. One in rc and one in star settings.')
-                    if normranges is None:
-                        normspec = addspec
-                    else:
-                        normspec = utils.keepranges(addspec, normranges)
-                    safe = False if ('430' in name or '750' in name) else True
-                    normfac, normerr = normalize(spec, normspec, silent=silent, safe=safe)
-                    # HACK: phx plot breaks things, so I'm just not doing it for now
-                if plotnorms and normfac != 1.0 and 'phx' not in name:
-                    check.vetnormfacs(addspec, spec, normfac, normranges)
-
-            addspec['flux'] *= normfac
-            addspec['error'] *= normfac
-            addspec['normfac'] = normfac
-            specs[i] = addspec  # so i can use normalized specs later (lya)
-            rc.normfacs[star][inst] = normfac, normerr
-        else:
-            if 'phx' not in name and 'g430' not in name:
-                rc.normfacs[star][inst] = 1.0, np.nan
-            if not silent: print '\twon\'t normalize, cuz you said not to'
+                            normspec = utils.keepranges(addspec, normranges)
+                        safe = False if ('430' in name or '750' in name) else True
+                        normfac, normerr = normalize(spec, normspec, silent=silent, safe=safe)
+                        # HACK: phx plot breaks things, so I'm just not doing it for now
+                    if plotnorms and normfac != 1.0 and 'phx' not in name:
+                        check.vetnormfacs(addspec, spec, normfac, normranges)
+
+                addspec['flux'] *= normfac
+                addspec['error'] *= normfac
+                addspec['normfac'] = normfac
+                specs[i] = addspec  # so i can use normalized specs later (lya)
+                normfacs[inst] = normfac, normerr
+            else:
+                if 'phx' not in name and 'g430' not in name:
+                    normfacs[inst] = 1.0, np.nan
+                if not silent: print '\twon\'t normalize, cuz you said not to'
 
-        spec = smartsplice(spec, addspec)
+            with perf.stage('smartsplice'):
+                spec = smartsplice(spec, addspec)
     spec.meta['NAME'] = db.parse_name(db.panpath(star))
-    if savespecs:
-        with open(rc.normfac_file, 'w') as f:
-            json.dump(rc.normfacs, f)
 
     # replace lya portion with model or normalized stis data
     if lyaspec is None:
@@ -270,34 +409,8 @@ def panspectrum(star, savespecs=True, plotnorms=False, silent=False, phxnormerr=
             print ('replacing section {:.1f}-{:.1f} with data from {lf}'
                    ''.format(*lyacut, lf=lyaspec.meta['NAME']))
     lyaspec = utils.keepranges(lyaspec, lyacut)
-    spec = splice(spec, lyaspec)
-
-    # fill any remaining gaps
-    order, span = rc.gap_fit_order, rc.gap_fit_span
-    if not silent:
-        print ('filling in any gaps with an order {} polynomial fit to an '
-               'area {}x the gap width'.format(order, span))
-    spec = fill_gaps(spec, fill_with=order, fit_span=span, silent=silent, mingapR=10.0)
-
-    spec.meta['LNZ_NORM'], spec.meta['LNZ_GAM'] = lntz_params
-
-    assert not utils.hasgaps(spec)
 
-    # resample at constant dw
-    dw = rc.panres
-    if not silent:
-        print ('creating resampled panspec at dw = {:.1f} AA'.format(dw))
-    dspec = utils.evenbin(spec, dw)
-
-    # save to fits
-    if savespecs:
-        paths = [db.panpath(star), db.dpanpath(star, dw)]
-        if not silent:
-            print 'saving spectra to \n' + '\n\t'.join(paths)
-        for s, path in zip([spec, dspec], paths):
-            io.writefits(s, path, overwrite=True)
-
-    return spec
+    return spec, lyaspec, lntz_params, normfacs
 
 
 def lorentz_fit(spec, wcen, guess):
@@ -484,10 +597,9 @@ def norm2photometry(spec, photom_tbl=None, band_dict=None, silent=False, plotfit
     # compute synthetic phot in all bands used in table
     synphot_dict = {}
     for key, band in band_dict.items():
-        wb, rb = band.T
-        vb = (const.c/(wb*u.AA)).to(u.Hz).value
-        rbi = np.interp(v[::-1], vb[::-1], rb[::-1])[::-1]
-        synphot_dict[key] = np.trapz(rbi*fnu, v)/np.trapz(rb, vb) # Jy
+        band = filters.asfilter(band, key)
+        rbi = np.interp(v[::-1], band.v[::-1], band.response[::-1])[::-1]
+        synphot_dict[key] = np.trapz(rbi*fnu, v)/band.vnorm # Jy
 
     if type(err) is not str:
         std = err
@@ -550,9 +662,7 @@ def norm2photometry(spec, photom_tbl=None, band_dict=None, silent=False, plotfit
         ## use mean filter wavelength
         wp = []
         for line in tbl:
-            band = band_dict[line['sed_filter']]
-            w, T = band.T
-            wp.append(np.sum(w*T)/np.sum(T))
+            wp.append(filters.asfilter(band_dict[line['sed_filter']]).wmean)
         # wp = (const.c/vp).to(u.AA).value
 
         xlim = [0.9*min(wp), 1.1*max(wp)]
@@ -1608,6 +1718,22 @@ def auto_flares(star, bands, inst, label, dt=1.0, silent=False):
     flareTable.write(db.flarepath(star, inst, label), format='fits', overwrite=True)
 
 
+def auto_broadflares(star, dt=1.0, silent=False):
+    """
+    Find flares in the broad bands of rc.flare_bands for each instrument
+    with a photon file for star. The flare tables are labeled 'broad' plus the
+    grating number and 'a', e.g. broad130a, which is the default master band
+    in match_flares.
+    """
+    for inst, bands in rc.flare_bands.items():
+        if len(db.findfiles('photons', star, inst)) == 0:
+            continue
+        label = 'broad{}a'.format(inst.split('_')[2][1:4])
+        if not silent:
+            print 'finding flares in the {} {} bands'.format(inst, label)
+        auto_flares(star, bands, inst, label, dt=dt, silent=silent)
+
+
 def match_flares(star, inst, bandlabels='all', masterband='broad130a', flarecut=None):
     """
     Match the flares from the tables of flares for the bands sepcified by bandlables for specified star and instrument.
@@ -19,6 +19,7 @@ from scipy.integrate import quad
 import rc
 import io
 import db
+import filters
 import mypy.my_numpy as mnp
 from mypy import specutils
 from matplotlib import pyplot as plt # for debugging
@@ -760,12 +761,10 @@ def _readband(band):
     files = {'J':'2massJ.txt', 'H':'2massH.txt', 'K':'2massKs.txt', 'B':'tychoB.txt', 'V':'tychoV.txt',
              'NUV':'galexNUV.txt'}
 
-    filterfile = path.join(rc.filterpath, files[band])
-    with open(filterfile) as filter:
-        zeropoint = float(filter.readline().strip())
-        wf, yf = np.loadtxt(filter).T
-
-    return wf, yf, zeropoint
+    f = filters.get(files[band][:-4])
+    if np.isnan(f.zeropoint):
+        raise ValueError('The first line of {} should be the zeropoint magnitude of the band.'.format(files[band]))
+    return f.w, f.response, f.zeropoint
 
 
 def add_photonflux(spectbl):
@@ -900,13 +899,10 @@ def killnegatives(spectbl, sep_insts=False, quickndirty=False, minSN=None, res_l
 
 
 def seriousflags(spec):
-    insts = np.unique(spec['instrument'])
-    bad = np.zeros(len(spec), bool)
-    for inst in insts:
-        sdqs = rc.seriousdqs(inst, from_x1d_header=False)
-        arg_inst = spec['instrument'] == inst
-        bad[arg_inst] = np.bitwise_and(spec[arg_inst]['flags'], sdqs) > 0
-    return bad
+    if len(spec) == 0:
+        return np.zeros(0, bool)
+    sdqs = rc.seriousdq_masks(np.asarray(spec['instrument']))
+    return np.bitwise_and(np.asarray(spec['flags']), sdqs) > 0
 
 
 def compare_specs(spec_new, spec_old, savetxt=None):